@@ -1,11 +1,60 @@
 import os
 import time
 
+try:
+    import liburing
+except ImportError:
+    liburing = None
+
+URING_DEPTH = 256
+URING_BATCH = 128
+
+
+def read_with_uring(fd, size, iterations):
+    ring = liburing.Ring()
+    cqe = liburing.Cqe()
+    try:
+        # SQPOLL lets the kernel poll the submission queue (no io_uring_enter).
+        liburing.io_uring_queue_init(URING_DEPTH, ring, liburing.IORING_SETUP_SQPOLL)
+    except Exception:
+        liburing.io_uring_queue_init(URING_DEPTH, ring, 0)
+
+    buffers = [bytearray(size) for _ in range(min(iterations, URING_BATCH))]
+    errors = 0
+    remaining = iterations
+    try:
+        while remaining > 0:
+            batch = min(remaining, URING_BATCH)
+            for i in range(batch):
+                sqe = liburing.io_uring_get_sqe(ring)
+                liburing.io_uring_prep_read(sqe, fd, buffers[i], 0)
+            liburing.io_uring_submit(ring)
+            for _ in range(batch):
+                liburing.io_uring_wait_cqe(ring, cqe)
+                if cqe[0].res < 0:
+                    errors += 1
+                liburing.io_uring_cqe_seen(ring, cqe[0])
+            remaining -= batch
+    finally:
+        liburing.io_uring_queue_exit(ring)
+    return errors
+
+
+def _env(name, default, cast=int):
+    value = os.environ.get(name)
+    return cast(value) if value is not None else default
+
 
 def main():
-    path = os.environ.get("BENCH_PATH", "/tmp/bench.txt")
-    iterations = int(os.environ.get("BENCH_ITER", "500"))
+    path = _env("BENCH_PATH", "/tmp/bench.txt", str)
+    iterations = _env("BENCH_ITER", 500)
+    persist = _env("BENCH_PERSIST", True, lambda value: value == "1")
+    backend = _env("BENCH_BACKEND", "sync", str)
+    if backend == "uring" and liburing is None:
+        print("[Bench] liburing not available, using sync reads")
+        backend = "sync"
     payload = "x" * 1024
+    size = len(payload)
     errors = 0
 
     try:
@@ -15,12 +64,40 @@ def main():
         print(f"[Bench] write failed: {exc}")
 
     start = time.perf_counter()
-    for _ in range(iterations):
+    if backend == "uring":
+        fd = -1
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            errors += read_with_uring(fd, size, iterations)
+        except OSError:
+            errors += iterations
+        finally:
+            if fd >= 0:
+                os.close(fd)
+    elif persist:
+        fd = -1
         try:
-            with open(path, "r", encoding="utf-8") as handle:
-                handle.read()
-        except Exception:
-            errors += 1
+            fd = os.open(path, os.O_RDONLY)
+            for _ in range(iterations):
+                try:
+                    os.pread(fd, size, 0)
+                except OSError:
+                    errors += 1
+        except OSError:
+            errors += iterations
+        finally:
+            if fd >= 0:
+                os.close(fd)
+    else:
+        for _ in range(iterations):
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.read(fd, size)
+                finally:
+                    os.close(fd)
+            except OSError:
+                errors += 1
     elapsed_ms = (time.perf_counter() - start) * 1000
 
     print(f"[Bench] fs_read elapsed_ms={elapsed_ms:.2f} errors={errors}")
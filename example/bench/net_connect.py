@@ -3,11 +3,16 @@ import socket
 import time
 
 
+def _env(name, default, cast=int):
+    value = os.environ.get(name)
+    return cast(value) if value is not None else default
+
+
 def main():
-    host = os.environ.get("BENCH_HOST", "93.184.216.34")
-    port = int(os.environ.get("BENCH_PORT", "80"))
-    iterations = int(os.environ.get("BENCH_ITER", "200"))
-    timeout = float(os.environ.get("BENCH_TIMEOUT", "0.2"))
+    host = _env("BENCH_HOST", "93.184.216.34", str)
+    port = _env("BENCH_PORT", 80)
+    iterations = _env("BENCH_ITER", 200)
+    timeout = _env("BENCH_TIMEOUT", 0.2, float)
     errors = 0
 
     start = time.perf_counter()
@@ -15,7 +20,7 @@ def main():
         try:
             with socket.create_connection((host, port), timeout=timeout) as sock:
                 sock.settimeout(timeout)
-        except Exception:
+        except OSError:
             errors += 1
     elapsed_ms = (time.perf_counter() - start) * 1000
 
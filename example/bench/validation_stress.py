@@ -2,83 +2,180 @@ import os
 import socket
 import time
 import json
-
-
-def run_file_ops(path, fs_ops, write_every):
-    payload = "x" * 1024
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+PAYLOAD = b"x" * 1024
+WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+NET_WORKERS = 16
+
+
+def write_payload(path, persist, fds):
+    if persist:
+        if fds["write"] < 0:
+            fds["write"] = os.open(path, WRITE_FLAGS, 0o644)
+        os.ftruncate(fds["write"], 0)
+        os.pwrite(fds["write"], PAYLOAD, 0)
+        return
+    fd = os.open(path, WRITE_FLAGS, 0o644)
+    try:
+        os.write(fd, PAYLOAD)
+    finally:
+        os.close(fd)
+
+
+def read_payload(path, persist, fds):
+    size = len(PAYLOAD)
+    try:
+        if persist:
+            os.pread(fds["read"], size, 0)
+        else:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.read(fd, size)
+            finally:
+                os.close(fd)
+        return "ok"
+    except OSError:
+        return "err"
+
+
+def run_file_ops(cfg):
+    path = cfg.bench_path
+    fs_ops = cfg.fs_ops
+    write_every = cfg.write_every
+    persist = cfg.persist
+    parallel = cfg.fs_parallel
     reads = 0
     writes = 0
     errors = 0
+    fds = {"read": -1, "write": -1}
+    executor = ThreadPoolExecutor(max_workers=parallel) if parallel > 1 else None
 
-    for i in range(fs_ops):
-        if i % write_every == 0:
+    try:
+        # Each batch starts with the write the serial loop would have issued,
+        # followed by the reads up to the next write.
+        for batch_start in range(0, fs_ops, write_every):
             try:
-                with open(path, "w", encoding="utf-8") as handle:
-                    handle.write(payload)
+                write_payload(path, persist, fds)
                 writes += 1
-            except Exception:
+            except OSError:
                 errors += 1
 
-        try:
-            with open(path, "r", encoding="utf-8") as handle:
-                handle.read()
-            reads += 1
-        except Exception:
-            errors += 1
+            if persist and fds["read"] < 0:
+                try:
+                    fds["read"] = os.open(path, os.O_RDONLY)
+                except OSError:
+                    pass
+
+            batch = range(batch_start, min(batch_start + write_every, fs_ops))
+            if executor is None:
+                results = [read_payload(path, persist, fds) for _ in batch]
+            else:
+                results = list(
+                    executor.map(lambda _: read_payload(path, persist, fds), batch)
+                )
+            counts = Counter(results)
+            reads += counts["ok"]
+            errors += counts["err"]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        for fd in fds.values():
+            if fd >= 0:
+                os.close(fd)
 
     return {"reads": reads, "writes": writes, "errors": errors}
 
 
-def run_network_ops(allow_host, deny_host, port, net_ops, timeout):
-    allowed = 0
-    denied = 0
-    errors = 0
+def connect_once(host, port, timeout):
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.settimeout(timeout)
+        return "allowed"
+    except PermissionError:
+        return "denied"
+    except OSError:
+        return "errors"
+
+
+def run_network_ops(cfg):
+    port = cfg.target_port
+    net_ops = cfg.net_ops
+    timeout = cfg.net_timeout
+    # Connect to the configured host strings: policies are written against
+    # them, and "localhost" and "127.0.0.1" must stay distinct targets.
+    hosts = [cfg.allow_host if i % 2 == 0 else cfg.deny_host for i in range(net_ops)]
+
+    if cfg.serial or net_ops <= 1:
+        results = [connect_once(host, port, timeout) for host in hosts]
+    else:
+        # Connects are independent waits on the network, so overlap them.
+        with ThreadPoolExecutor(max_workers=min(net_ops, NET_WORKERS)) as executor:
+            results = list(
+                executor.map(lambda host: connect_once(host, port, timeout), hosts)
+            )
+
+    counts = Counter(results)
+    return {
+        "allowed": counts["allowed"],
+        "denied": counts["denied"],
+        "errors": counts["errors"],
+    }
 
-    for i in range(net_ops):
-        host = allow_host if i % 2 == 0 else deny_host
-        try:
-            with socket.create_connection((host, port), timeout=timeout) as sock:
-                sock.settimeout(timeout)
-            allowed += 1
-        except PermissionError:
-            denied += 1
-        except Exception:
-            errors += 1
 
-    return {"allowed": allowed, "denied": denied, "errors": errors}
+def _env(name, default, cast=int):
+    value = os.environ.get(name)
+    return cast(value) if value is not None else default
 
 
-def main():
-    bench_path = os.environ.get("BENCH_PATH", "/tmp/bench.txt")
-    fs_ops = int(os.environ.get("BENCH_FS_OPS", "200"))
-    write_every = int(os.environ.get("BENCH_FS_WRITE_EVERY", "10"))
-    net_ops = int(os.environ.get("BENCH_NET_OPS", "10"))
-    timeout_ms = float(os.environ.get("BENCH_NET_TIMEOUT_MS", "300"))
-    timeout = timeout_ms / 1000
+def _flag(value):
+    return value == "1"
 
-    allow_host = os.environ.get("BENCH_ALLOW_HOST", "localhost")
-    deny_host = os.environ.get("BENCH_DENY_HOST", "127.0.0.1")
-    target_port = int(os.environ.get("BENCH_TARGET_PORT", "9"))
+
+def load_config():
+    timeout_ms = _env("BENCH_NET_TIMEOUT_MS", 300.0, float)
+    return SimpleNamespace(
+        bench_path=_env("BENCH_PATH", "/tmp/bench.txt", str),
+        fs_ops=_env("BENCH_FS_OPS", 200),
+        write_every=_env("BENCH_FS_WRITE_EVERY", 10),
+        persist=_env("BENCH_PERSIST", False, _flag),
+        fs_parallel=max(1, _env("BENCH_FS_PARALLEL", 1)),
+        serial=_env("BENCH_SERIAL", False, _flag),
+        net_ops=_env("BENCH_NET_OPS", 10),
+        net_timeout=timeout_ms / 1000,
+        allow_host=_env("BENCH_ALLOW_HOST", "localhost", str),
+        deny_host=_env("BENCH_DENY_HOST", "127.0.0.1", str),
+        target_port=_env("BENCH_TARGET_PORT", 9),
+    )
+
+
+def main():
+    cfg = load_config()
 
     fs_start = time.perf_counter()
-    fs_stats = run_file_ops(bench_path, fs_ops, write_every)
+    fs_stats = run_file_ops(cfg)
     fs_elapsed_ms = (time.perf_counter() - fs_start) * 1000
 
     net_start = time.perf_counter()
-    net_stats = run_network_ops(allow_host, deny_host, target_port, net_ops, timeout)
+    net_stats = run_network_ops(cfg)
     net_elapsed_ms = (time.perf_counter() - net_start) * 1000
 
     meta = {
         "proxyMode": "direct",
-        "benchPath": bench_path,
-        "allowHost": allow_host,
-        "denyHost": deny_host,
-        "targetPort": target_port,
-        "fsOps": fs_ops,
+        "benchPath": cfg.bench_path,
+        "allowHost": cfg.allow_host,
+        "denyHost": cfg.deny_host,
+        "targetPort": cfg.target_port,
+        "fsOps": cfg.fs_ops,
+        "fsPersist": cfg.persist,
+        "fsParallel": cfg.fs_parallel,
+        "netSerial": cfg.serial,
         "fsReads": fs_stats["reads"],
         "fsWrites": fs_stats["writes"],
         "fsErrors": fs_stats["errors"],
-        "netOps": net_ops,
+        "netOps": cfg.net_ops,
         "netAllowed": net_stats["allowed"],
         "netDenied": net_stats["denied"],
         "netErrors": net_stats["errors"],
@@ -5,10 +5,13 @@ import subprocess
 
 print("[Example] Expected: bash exec denied")
 try:
-    result = subprocess.run(
-        ["/bin/bash", "-c", "echo denied"], capture_output=True, text=True, check=True
+    subprocess.run(
+        ["/bin/bash", "-c", "echo denied"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=False,
+        check=True,
     )
     print("[Executor] bash executed (unexpected)")
-    print(result.stdout.strip())
 except Exception as exc:
     print(f"[Executor] bash exec denied: {exc}")
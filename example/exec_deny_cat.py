@@ -5,10 +5,13 @@ import subprocess
 
 print("[Example] Expected: /bin/cat exec denied")
 try:
-    result = subprocess.run(
-        ["/bin/cat", "--version"], capture_output=True, text=True, check=True
+    subprocess.run(
+        ["/bin/cat", "--version"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=False,
+        check=True,
     )
     print("[Executor] /bin/cat executed (unexpected)")
-    print(result.stdout.strip())
 except Exception as exc:
     print(f"[Executor] /bin/cat exec denied: {exc}")
@@ -5,10 +5,13 @@ import subprocess
 
 print("[Example] Expected: /usr/bin/curl exec denied")
 try:
-    result = subprocess.run(
-        ["/usr/bin/curl", "--version"], capture_output=True, text=True, check=True
+    subprocess.run(
+        ["/usr/bin/curl", "--version"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=False,
+        check=True,
     )
     print("[Executor] /usr/bin/curl executed (unexpected)")
-    print(result.stdout.strip())
 except Exception as exc:
     print(f"[Executor] /usr/bin/curl exec denied: {exc}")
@@ -5,10 +5,13 @@ import subprocess
 
 print("[Example] Expected: /bin/ls exec denied")
 try:
-    result = subprocess.run(
-        ["/bin/ls", "/tmp"], capture_output=True, text=True, check=True
+    subprocess.run(
+        ["/bin/ls", "/tmp"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=False,
+        check=True,
     )
     print("[Executor] /bin/ls executed (unexpected)")
-    print(result.stdout.strip())
 except Exception as exc:
     print(f"[Executor] /bin/ls exec denied: {exc}")
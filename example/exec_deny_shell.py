@@ -5,10 +5,13 @@ import subprocess
 
 print("[Example] Expected: /bin/sh exec denied")
 try:
-    result = subprocess.run(
-        ["/bin/sh", "-c", "echo denied"], capture_output=True, text=True, check=True
+    subprocess.run(
+        ["/bin/sh", "-c", "echo denied"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=False,
+        check=True,
     )
     print("[Executor] /bin/sh executed (unexpected)")
-    print(result.stdout.strip())
 except Exception as exc:
     print(f"[Executor] /bin/sh exec denied: {exc}")
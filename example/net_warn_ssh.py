@@ -4,7 +4,6 @@
 
 import socket
 import threading
-import time
 
 
 def start_server(port):
@@ -12,15 +11,19 @@ def start_server(port):
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server.bind(("127.0.0.1", port))
     server.listen(1)
+    return server
+
+
+def accept_once(server):
     conn, _ = server.accept()
     conn.close()
     server.close()
 
 
 print("[Example] Expected: SSH port connection warning")
-server_thread = threading.Thread(target=start_server, args=(2222,), daemon=True)
+server = start_server(2222)
+server_thread = threading.Thread(target=accept_once, args=(server,), daemon=True)
 server_thread.start()
-time.sleep(0.1)
 try:
     sock = socket.create_connection(("127.0.0.1", 2222), timeout=2)
     print("[Executor] SSH connection succeeded")
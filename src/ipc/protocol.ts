@@ -16,3 +16,19 @@ export enum ResponseType {
 }
 
 export const MSG_HEADER_SIZE = 9;
+
+// Bytes reserved in front of each ring's data region (see ringbuffer.ts).
+export const RING_HEADER_SIZE = 192;
+
+// Bits of the bun2py ring's policy-checks byte: the worker only reports an
+// operation kind to the Supervisor while its bit is set. AUDIT means some
+// action is "warn", which is logged per operation, so the worker must not
+// answer repeats from its verdict cache.
+export enum PolicyCheck {
+  FS = 0x01,
+  NET = 0x02,
+  EXEC = 0x04,
+  AUDIT = 0x08,
+}
+
+export const POLICY_CHECK_ALL = PolicyCheck.FS | PolicyCheck.NET | PolicyCheck.EXEC;
@@ -1,4 +1,14 @@
 import { toArrayBuffer, type Pointer } from "bun:ffi";
+import { RING_HEADER_SIZE } from "./protocol";
+
+// Header field offsets. The consumer-owned head, the producer-owned tail and
+// the fields written once at startup each sit on their own cache line.
+const HEAD_OFFSET = 0;
+const TAIL_OFFSET = 64;
+const PENDING_OFFSET = 68;
+const CAPACITY_OFFSET = 128;
+const POLICY_CHECKS_OFFSET = 132;
+const POLICY_GENERATION_OFFSET = 136;
 
 export class SharedRingBuffer {
   private headerView: DataView;
@@ -10,34 +20,61 @@ export class SharedRingBuffer {
     if (ptrAddr === 0) throw new Error("Invalid pointer");
 
     const buffer = toArrayBuffer(ptrAddr as unknown as Pointer, 0, size);
-    this.headerView = new DataView(buffer, 0, 64);
-    this.dataView = new Uint8Array(buffer, 64, size - 64);
+    this.headerView = new DataView(buffer, 0, RING_HEADER_SIZE);
+    this.dataView = new Uint8Array(buffer, RING_HEADER_SIZE, size - RING_HEADER_SIZE);
     this.lenBytes = new Uint8Array(4);
     this.lenView = new DataView(this.lenBytes.buffer);
   }
 
   get head(): number {
-    return this.headerView.getUint32(0, true);
+    return this.headerView.getUint32(HEAD_OFFSET, true);
   }
 
   set head(val: number) {
-    this.headerView.setUint32(0, val, true);
+    this.headerView.setUint32(HEAD_OFFSET, val, true);
   }
 
   get tail(): number {
-    return this.headerView.getUint32(4, true);
+    return this.headerView.getUint32(TAIL_OFFSET, true);
   }
 
   set tail(val: number) {
-    this.headerView.setUint32(4, val, true);
+    this.headerView.setUint32(TAIL_OFFSET, val, true);
   }
 
   get capacity(): number {
-    return this.headerView.getUint32(8, true);
+    return this.headerView.getUint32(CAPACITY_OFFSET, true);
   }
 
   set capacity(val: number) {
-    this.headerView.setUint32(8, val, true);
+    this.headerView.setUint32(CAPACITY_OFFSET, val, true);
+  }
+
+  // Set by the writer when it has published data without a socket notification.
+  get pending(): number {
+    return this.headerView.getUint8(PENDING_OFFSET);
+  }
+
+  set pending(val: number) {
+    this.headerView.setUint8(PENDING_OFFSET, val);
+  }
+
+  // PolicyCheck bits published by the Supervisor on the bun2py ring.
+  get policyChecks(): number {
+    return this.headerView.getUint8(POLICY_CHECKS_OFFSET);
+  }
+
+  set policyChecks(val: number) {
+    this.headerView.setUint8(POLICY_CHECKS_OFFSET, val);
+  }
+
+  // Bumped on every policy publish; the worker drops cached verdicts when it changes.
+  get policyGeneration(): number {
+    return this.headerView.getUint32(POLICY_GENERATION_OFFSET, true);
+  }
+
+  set policyGeneration(val: number) {
+    this.headerView.setUint32(POLICY_GENERATION_OFFSET, val, true);
   }
 
   write(data: Uint8Array): number {
@@ -4,12 +4,20 @@ import { unlink } from "node:fs";
 import { NetworkProxy } from "../proxy";
 import { type SandboxConfig } from "../config";
 import { join } from "path";
-import { MsgType, ResponseType } from "./protocol";
+import { MsgType, ResponseType, POLICY_CHECK_ALL, RING_HEADER_SIZE } from "./protocol";
 
 export type CheckCallback = (type: MsgType, payload: Uint8Array) => { allowed: boolean };
 
 export type WorkerState = "idle" | "running" | "stopped" | "killed";
 
+// Largest power of two not above n (n >= 1).
+function floorPow2(n: number): number {
+  return 2 ** Math.floor(Math.log2(n));
+}
+
+// How often to look for output the worker published without a DATA signal.
+const PENDING_POLL_MS = 5;
+
 export class IPCServer {
   private shmFd: number;
   private shmPtr: number;
@@ -17,10 +25,13 @@ export class IPCServer {
   private shmName: string;
   
   public py2bun: SharedRingBuffer;
+  public py2bunCtrl: SharedRingBuffer;
   public bun2py: SharedRingBuffer;
   
   private socketPath: string;
   private server: any;
+  private client: any = null;
+  private pendingTimer: ReturnType<typeof setInterval> | null = null;
   private proxy: NetworkProxy | null = null;
   private processHandle: ReturnType<typeof Bun.spawn> | undefined;
   private sandboxPid: number | undefined; // Store PID for manual management
@@ -38,6 +49,13 @@ export class IPCServer {
     onMessage?: (data: Uint8Array) => void,
     onCheck?: CheckCallback
   ) {
+    // Each ring's data region is a power of two so the Python worker can wrap
+    // offsets with a mask; the segment grows by the ring headers. Policy
+    // checks get their own worker->Bun ring so they never queue behind stdout.
+    const capacity = floorPow2(Math.max(1, Math.floor(size / 2)));
+    const ringSize = capacity + RING_HEADER_SIZE;
+    size = ringSize * 3;
+
     this.shmName = shmName;
     this.shmSize = size;
     this.onMessage = onMessage;
@@ -51,18 +69,26 @@ export class IPCServer {
     this.shmPtr = mmap(this.shmFd, size);
     if (this.shmPtr === 0) throw new Error("Failed to mmap");
     
-    const ringSize = Math.floor(size / 2);
-    
     this.bun2py = new SharedRingBuffer(this.shmPtr, ringSize);
     this.py2bun = new SharedRingBuffer(this.shmPtr + ringSize, ringSize);
+    this.py2bunCtrl = new SharedRingBuffer(this.shmPtr + ringSize * 2, ringSize);
     
-    this.bun2py.capacity = ringSize - 64;
+    this.bun2py.capacity = capacity;
     this.bun2py.head = 0;
     this.bun2py.tail = 0;
+    // Report everything until the Supervisor publishes the active policy.
+    this.bun2py.policyChecks = POLICY_CHECK_ALL;
+    this.bun2py.policyGeneration = 0;
     
-    this.py2bun.capacity = ringSize - 64;
+    this.py2bun.capacity = capacity;
     this.py2bun.head = 0;
     this.py2bun.tail = 0;
+    this.py2bun.pending = 0;
+
+    this.py2bunCtrl.capacity = capacity;
+    this.py2bunCtrl.head = 0;
+    this.py2bunCtrl.tail = 0;
+    this.py2bunCtrl.pending = 0;
 
     const socketName = `bun-${Math.random().toString(36).slice(2)}.sock`;
     const socketDir = process.env.IPC_SOCKET_DIR ?? process.cwd();
@@ -93,6 +119,7 @@ export class IPCServer {
       socket: {
         open(socket) {
           console.log("[Bun] Python connected!");
+          that.client = socket;
           if (that.onStateChange) that.onStateChange("Python Connected", "READY");
         },
         data(socket, data) {
@@ -119,6 +146,7 @@ export class IPCServer {
         },
         close() {
           console.log("[Bun] Python disconnected");
+          that.client = null;
           if (that.onStateChange) that.onStateChange("Disconnected", "CLOSE");
         },
         error(err) {
@@ -129,6 +157,11 @@ export class IPCServer {
 
     console.log(`[Bun] Socket created at ${this.socketPath}`);
 
+    this.pendingTimer = setInterval(() => {
+      if (this.py2bun.pending || this.py2bunCtrl.pending) this.handleData();
+    }, PENDING_POLL_MS);
+    this.pendingTimer.unref?.();
+
     const args = [...command, this.socketPath, this.shmName, this.shmSize.toString()];
     
     // Prepare environment variables for the sandbox
@@ -243,9 +276,20 @@ export class IPCServer {
   }
   
   handleData() {
+    // Clear before draining so a write racing with us re-arms the flag.
+    this.py2bun.pending = 0;
+    this.py2bunCtrl.pending = 0;
+    // Checks first: an optimistic report published before some output is
+    // then judged before that output is delivered.
+    if (!this.drain(this.py2bunCtrl)) return;
+    this.drain(this.py2bun);
+  }
+
+  // Returns false once a violation has killed the worker.
+  private drain(ring: SharedRingBuffer): boolean {
     while (true) {
-        const msg = this.py2bun.read();
-        if (!msg) break;
+        const msg = ring.read();
+        if (!msg) return true;
 
         if (msg.length >= 5) {
             const type = msg[0] as MsgType;
@@ -265,7 +309,7 @@ export class IPCServer {
                     if (type === MsgType.FS_READ || type === MsgType.LISTDIR) {
                          console.error(`[Bun] Optimistic Violation (Type ${type})! Killing worker.`);
                          this.kill("policy-violation");
-                         return;
+                         return false;
                     }
                     this.sendResponse(reqId, ResponseType.DENY);
                 } else {
@@ -283,6 +327,11 @@ export class IPCServer {
     }
   }
 
+  setPolicyChecks(mask: number) {
+    this.bun2py.policyChecks = mask;
+    this.bun2py.policyGeneration = (this.bun2py.policyGeneration + 1) >>> 0;
+  }
+
   sendResponse(reqId: number, type: ResponseType) {
     const buf = new Uint8Array(5);
     const view = new DataView(buf.buffer);
@@ -306,6 +355,8 @@ export class IPCServer {
         console.warn("[Bun] Ring buffer full!");
         return false;
     }
+    // Wake a worker blocked on the socket instead of waiting for its poll.
+    this.client?.write("WAKE\n");
     return true;
   }
 
@@ -321,28 +372,24 @@ export class IPCServer {
   }
 
   getMemoryState() {
-    const bun2pySize = (this.bun2py.tail - this.bun2py.head + this.bun2py.capacity) % this.bun2py.capacity;
-    const py2bunSize = (this.py2bun.tail - this.py2bun.head + this.py2bun.capacity) % this.py2bun.capacity;
-
     return {
       shmName: this.shmName,
       shmSize: this.shmSize,
-      bun2py: {
-        head: this.bun2py.head,
-        tail: this.bun2py.tail,
-        capacity: this.bun2py.capacity,
-        used: bun2pySize,
-        free: this.bun2py.capacity - bun2pySize - 1,
-        usagePercent: ((bun2pySize / (this.bun2py.capacity - 1)) * 100).toFixed(1),
-      },
-      py2bun: {
-        head: this.py2bun.head,
-        tail: this.py2bun.tail,
-        capacity: this.py2bun.capacity,
-        used: py2bunSize,
-        free: this.py2bun.capacity - py2bunSize - 1,
-        usagePercent: ((py2bunSize / (this.py2bun.capacity - 1)) * 100).toFixed(1),
-      },
+      bun2py: this.ringState(this.bun2py),
+      py2bun: this.ringState(this.py2bun),
+      py2bunCtrl: this.ringState(this.py2bunCtrl),
+    };
+  }
+
+  private ringState(ring: SharedRingBuffer) {
+    const used = (ring.tail - ring.head + ring.capacity) % ring.capacity;
+    return {
+      head: ring.head,
+      tail: ring.tail,
+      capacity: ring.capacity,
+      used,
+      free: ring.capacity - used - 1,
+      usagePercent: ((used / (ring.capacity - 1)) * 100).toFixed(1),
     };
   }
 
@@ -374,6 +421,10 @@ export class IPCServer {
             process.kill(this.sandboxPid, "SIGKILL");
         } catch {}
     }
+    if (this.pendingTimer) {
+        clearInterval(this.pendingTimer);
+        this.pendingTimer = null;
+    }
     if (this.proxy) {
         this.proxy.stop();
         this.proxy = null;
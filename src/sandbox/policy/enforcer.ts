@@ -4,74 +4,211 @@ import {
   type FsPerm,
   type NormalizedNetRule,
 } from "./loader";
-import nodeCidr from "node-cidr";
 import path from "path";
 
+// Character trie over rule paths. Walking a target path visits exactly the
+// rules whose path is a string prefix of it (the startsWith semantics rules
+// have always had), with actions folded per permission at each node.
+interface FsTrieNode {
+  children: Map<string, FsTrieNode>;
+  actions: Map<FsPerm, Action> | null;
+}
+
+// Bound on memoized fs decisions per policy.
+const FS_CACHE_SIZE = 1024;
+
+interface CompiledNetRule {
+  proto: "tcp" | "udp";
+  network: number;
+  mask: number;
+  ports: NormalizedNetRule["ports"];
+  action: Action;
+}
+
+const ACTION_RANK: Record<Action, number> = { allow: 1, warn: 2, deny: 3 };
+
+// Parse a dotted-quad IPv4 address into an unsigned 32-bit integer, or null.
+function parseIPv4(ip: string): number | null {
+  const parts = ip.split(".");
+  if (parts.length !== 4) return null;
+  let value = 0;
+  for (const part of parts) {
+    if (!/^\d{1,3}$/.test(part)) return null;
+    const octet = Number(part);
+    if (octet > 255) return null;
+    value = value * 256 + octet;
+  }
+  return value >>> 0;
+}
+
+function prefixMask(bits: number): number {
+  return bits === 0 ? 0 : (0xffffffff << (32 - bits)) >>> 0;
+}
+
+// Absolute paths without "." segments or repeated/trailing separators are
+// already in resolved form, so path.resolve (and its cwd lookup) is skipped.
+function resolvePath(target: string): string {
+  if (
+    target.startsWith("/") &&
+    !target.includes("/.") &&
+    !target.includes("//") &&
+    (target.length === 1 || !target.endsWith("/"))
+  ) {
+    return target;
+  }
+  return path.resolve(target);
+}
+
+// The resolved action does not depend on rule order, so rules are kept
+// strongest first (deny, warn, allow) and the first match is the answer.
+function byStrength<T extends { action: Action }>(rules: T[]): T[] {
+  return rules.sort((a, b) => ACTION_RANK[b.action] - ACTION_RANK[a.action]);
+}
+
 export class PolicyEnforcer {
   private policy: NormalizedPolicy;
+  // Rules are compiled once per policy so checks only compare prepared values.
+  private fsTrie: FsTrieNode | null;
+  private fsCache = new Map<string, Action>();
+  private netRules: CompiledNetRule[] | null;
+  private execActions: Map<string, Action> | null;
 
   constructor(policy: NormalizedPolicy) {
     this.policy = policy;
+    this.fsTrie = policy.fs?.rules ? this.compileFsRules(policy.fs.rules) : null;
+    this.netRules = policy.net?.rules
+      ? byStrength(policy.net.rules.flatMap((rule) => this.compileNetRule(rule) ?? []))
+      : null;
+    this.execActions = policy.exec?.rules ? this.compileExecRules(policy.exec.rules) : null;
+  }
+
+  // False when every check of this kind resolves to allow: no rules and an
+  // allow default.
+  public needsCheck(kind: "fs" | "net" | "exec"): boolean {
+    return Boolean(this.policy[kind]?.rules?.length) || this.policy.defaults[kind] !== "allow";
+  }
+
+  // True when a rule or default resolves to warn.
+  public hasWarnActions(): boolean {
+    return (["fs", "net", "exec"] as const).some(
+      (kind) =>
+        this.policy.defaults[kind] === "warn" ||
+        (this.policy[kind]?.rules ?? []).some((rule) => rule.action === "warn"),
+    );
   }
 
   public checkFs(targetPath: string, perm: FsPerm): Action {
-    if (!this.policy.fs?.rules) {
+    if (!this.fsTrie) {
       return this.policy.defaults.fs;
     }
 
-    const absPath = path.resolve(targetPath);
-    const actions: Action[] = [];
-
-    for (const rule of this.policy.fs.rules) {
-      if (absPath.startsWith(rule.path) && rule.perms.includes(perm)) {
-        actions.push(rule.action);
-      }
+    const absPath = resolvePath(targetPath);
+    const key = perm + "\0" + absPath;
+    const cached = this.fsCache.get(key);
+    if (cached !== undefined) {
+      return cached;
     }
 
-    return this.resolveAction(actions, this.policy.defaults.fs);
+    const action = this.matchFs(this.fsTrie, absPath, perm) ?? this.policy.defaults.fs;
+    if (this.fsCache.size >= FS_CACHE_SIZE) {
+      // Maps iterate in insertion order, so this drops the oldest entry.
+      this.fsCache.delete(this.fsCache.keys().next().value as string);
+    }
+    this.fsCache.set(key, action);
+    return action;
   }
 
   public checkNet(ip: string, port: number, proto: "tcp" | "udp"): Action {
-    if (!this.policy.net?.rules) {
+    if (!this.netRules) {
       return this.policy.defaults.net;
     }
 
-    const actions: Action[] = [];
-    const rules = this.policy.net.rules;
+    const addr = parseIPv4(ip);
+    if (addr === null) {
+      return this.policy.defaults.net;
+    }
 
-    for (const rule of rules) {
+    for (const rule of this.netRules) {
       if (rule.proto !== proto) continue;
-      
-      if (!nodeCidr.cidr.includes(rule.cidr, ip)) continue;
+
+      if (((addr & rule.mask) >>> 0) !== rule.network) continue;
 
       if (!this.portMatches(rule.ports, port)) continue;
 
-      actions.push(rule.action);
+      return rule.action;
     }
 
-    return this.resolveAction(actions, this.policy.defaults.net);
+    return this.policy.defaults.net;
   }
 
   public checkExec(cmdPath: string): Action {
-    if (!this.policy.exec?.rules) {
+    if (!this.execActions) {
       return this.policy.defaults.exec;
     }
 
-    const actions: Action[] = [];
-    for (const rule of this.policy.exec.rules) {
-      if (rule.path === cmdPath) {
-        actions.push(rule.action);
+    return this.execActions.get(cmdPath) ?? this.policy.defaults.exec;
+  }
+
+  private compileFsRules(rules: NonNullable<NormalizedPolicy["fs"]>["rules"]): FsTrieNode {
+    const root: FsTrieNode = { children: new Map(), actions: null };
+    for (const rule of rules) {
+      let node = root;
+      for (const ch of rule.path) {
+        let next = node.children.get(ch);
+        if (!next) {
+          next = { children: new Map(), actions: null };
+          node.children.set(ch, next);
+        }
+        node = next;
+      }
+      node.actions ??= new Map();
+      for (const perm of rule.perms) {
+        node.actions.set(perm, this.strongest(node.actions.get(perm) ?? null, rule.action));
       }
     }
+    return root;
+  }
+
+  private matchFs(root: FsTrieNode, absPath: string, perm: FsPerm): Action | null {
+    let matched = root.actions?.get(perm) ?? null;
+    if (matched === "deny") return matched;
+
+    let node: FsTrieNode | undefined = root;
+    for (const ch of absPath) {
+      node = node.children.get(ch);
+      if (!node) break;
+      const action = node.actions?.get(perm);
+      if (action) {
+        if (action === "deny") return action;
+        matched = this.strongest(matched, action);
+      }
+    }
+    return matched;
+  }
 
-    return this.resolveAction(actions, this.policy.defaults.exec);
+  // Null for rules that can never match: checks only carry IPv4 addresses,
+  // and the loader also accepts IPv6 CIDRs.
+  private compileNetRule(rule: NormalizedNetRule): CompiledNetRule | null {
+    const [address = "", bits = "32"] = rule.cidr.split("/");
+    const parsed = parseIPv4(address);
+    if (parsed === null) return null;
+    const mask = prefixMask(Number(bits));
+    const network = (parsed & mask) >>> 0;
+    return { proto: rule.proto, network, mask, ports: rule.ports, action: rule.action };
+  }
+
+  private compileExecRules(rules: NonNullable<NormalizedPolicy["exec"]>["rules"]): Map<string, Action> {
+    // Exec rules match on exact path, so all rules for a path fold into one action.
+    const actions = new Map<string, Action>();
+    for (const rule of rules) {
+      actions.set(rule.path, this.strongest(actions.get(rule.path) ?? null, rule.action));
+    }
+    return actions;
   }
 
-  private resolveAction(actions: Action[], fallback: Action): Action {
-    if (actions.includes("deny")) return "deny";
-    if (actions.includes("warn")) return "warn";
-    if (actions.includes("allow")) return "allow";
-    return fallback;
+  private strongest(current: Action | null, next: Action): Action {
+    if (current === null || ACTION_RANK[next] > ACTION_RANK[current]) return next;
+    return current;
   }
 
   private portMatches(ranges: NormalizedNetRule["ports"], port: number): boolean {
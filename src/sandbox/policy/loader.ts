@@ -64,24 +64,65 @@ export interface NormalizedPolicy extends Omit<Policy, 'net'> {
 }
 
 
+type PolicyValidator = ReturnType<Ajv["compile"]>;
+
+// Schema compilation is the expensive part of constructing a loader, so
+// every PolicyLoader shares one validator.
+let sharedValidator: PolicyValidator | null = null;
+
+function getValidator(): PolicyValidator {
+    if (!sharedValidator) {
+        const ajv = new Ajv({ useDefaults: true });
+        sharedValidator = ajv.compile<Policy>(policySchema);
+    }
+    return sharedValidator;
+}
+
+interface CachedPolicy {
+    source: string;
+    policy: NormalizedPolicy;
+}
+
+// Parsed policies by path; reused while the file's contents are unchanged.
+// Comparing the text rather than stat fields catches same-size rewrites
+// within the filesystem's timestamp granularity.
+const policyCache = new Map<string, CachedPolicy>();
+
+// Cached policies are shared by every caller, so they are made read-only.
+function deepFreeze<T>(value: T): T {
+    if (value && typeof value === "object" && !Object.isFrozen(value)) {
+        for (const child of Object.values(value)) {
+            deepFreeze(child);
+        }
+        Object.freeze(value);
+    }
+    return value;
+}
+
 export class PolicyLoader {
-    private ajv: Ajv;
-    private validator: ReturnType<Ajv["compile"]>;
+    private validator: PolicyValidator;
 
     constructor() {
-        this.ajv = new Ajv({ useDefaults: true });
-        this.validator = this.ajv.compile<Policy>(policySchema);
+        this.validator = getValidator();
     }
 
     public async load(policyPath: string): Promise<NormalizedPolicy> {
-        const policyFile = Bun.file(policyPath);
-        if (!await policyFile.exists()) {
+        const source = await Bun.file(policyPath).text().catch(() => null);
+        if (source === null) {
             throw new Error(`Policy file not found at: ${policyPath}`);
         }
-        const policy = await policyFile.json() as Policy;
+
+        const cached = policyCache.get(policyPath);
+        if (cached && cached.source === source) {
+            return cached.policy;
+        }
+
+        const policy = JSON.parse(source) as Policy;
 
         this.validatePolicy(policy);
-        return this.normalize(policy);
+        const normalized = deepFreeze(this.normalize(policy));
+        policyCache.set(policyPath, { source, policy: normalized });
+        return normalized;
     }
 
     public validatePolicy(policy: Policy): void {
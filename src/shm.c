@@ -4,6 +4,7 @@
 #include <unistd.h>
 #include <string.h>
 #include <stdio.h>
+#include <stdint.h>
 
 // Export C-compatible functions for Bun FFI
 
@@ -54,3 +55,85 @@ int ipc_munmap(void* ptr, size_t size) {
 int ipc_close(int fd) {
     return close(fd);
 }
+
+// Ring buffer helpers for the Python worker (loaded through ctypes).
+// `ring` points at a ring header: head u32 @0, tail u32 @64, capacity u32
+// @128, data at +192. Capacity is a power of two. Frames are [u32 len][payload].
+// The producer owns tail and the consumer owns head; each side reads the
+// other's index with acquire and publishes its own with release, so the
+// payload bytes are visible before the index that covers them.
+
+#define RING_HEADER_SIZE 192
+#define RING_HEAD 0
+#define RING_TAIL (64 / 4)
+#define RING_CAPACITY (128 / 4)
+
+static void ring_copy_in(uint8_t* data, uint32_t cap, uint32_t pos, const uint8_t* src, uint32_t len) {
+    uint32_t first = cap - pos < len ? cap - pos : len;
+    memcpy(data + pos, src, first);
+    if (first < len) memcpy(data, src + first, len - first);
+}
+
+static void ring_copy_out(const uint8_t* data, uint32_t cap, uint32_t pos, uint8_t* dst, uint32_t len) {
+    uint32_t first = cap - pos < len ? cap - pos : len;
+    memcpy(dst, data + pos, first);
+    if (first < len) memcpy(dst + first, data, len - first);
+}
+
+// Writes prefix + data as one frame. Returns the frame payload length, or 0
+// if the ring does not have room.
+uint32_t ipc_ring_write(uint8_t* ring, const uint8_t* prefix, uint32_t prefix_len,
+                        const uint8_t* data, uint32_t data_len) {
+    uint32_t* hdr = (uint32_t*)ring;
+    uint8_t* buf = ring + RING_HEADER_SIZE;
+    uint32_t cap = hdr[RING_CAPACITY];
+    uint32_t mask = cap - 1;
+    uint32_t head = __atomic_load_n(&hdr[RING_HEAD], __ATOMIC_ACQUIRE);
+    uint32_t tail = hdr[RING_TAIL];
+    uint32_t len = prefix_len + data_len;
+    uint32_t used = (tail - head) & mask;
+
+    if ((uint64_t)cap - used - 1 < (uint64_t)len + 4) return 0;
+
+    uint8_t len_bytes[4] = {
+        (uint8_t)len, (uint8_t)(len >> 8), (uint8_t)(len >> 16), (uint8_t)(len >> 24),
+    };
+    ring_copy_in(buf, cap, tail, len_bytes, 4);
+    tail = (tail + 4) & mask;
+    if (prefix_len) {
+        ring_copy_in(buf, cap, tail, prefix, prefix_len);
+        tail = (tail + prefix_len) & mask;
+    }
+    ring_copy_in(buf, cap, tail, data, data_len);
+    tail = (tail + data_len) & mask;
+
+    __atomic_store_n(&hdr[RING_TAIL], tail, __ATOMIC_RELEASE);
+    return len;
+}
+
+// Copies the next frame's payload into out and consumes it. Returns the
+// payload length, -1 if no complete frame is available, or -2 if out_cap is
+// too small (the frame is left in place).
+int64_t ipc_ring_read(uint8_t* ring, uint8_t* out, uint32_t out_cap) {
+    uint32_t* hdr = (uint32_t*)ring;
+    const uint8_t* buf = ring + RING_HEADER_SIZE;
+    uint32_t cap = hdr[RING_CAPACITY];
+    uint32_t mask = cap - 1;
+    uint32_t head = hdr[RING_HEAD];
+    uint32_t tail = __atomic_load_n(&hdr[RING_TAIL], __ATOMIC_ACQUIRE);
+    uint32_t size = (tail - head) & mask;
+
+    if (size < 4) return -1;
+
+    uint8_t len_bytes[4];
+    ring_copy_out(buf, cap, head, len_bytes, 4);
+    uint32_t len = (uint32_t)len_bytes[0] | ((uint32_t)len_bytes[1] << 8) |
+                   ((uint32_t)len_bytes[2] << 16) | ((uint32_t)len_bytes[3] << 24);
+
+    if (size - 4 < len) return -1;
+    if (len > out_cap) return -2;
+
+    ring_copy_out(buf, cap, (head + 4) & mask, out, len);
+    __atomic_store_n(&hdr[RING_HEAD], (head + 4 + len) & mask, __ATOMIC_RELEASE);
+    return len;
+}
@@ -5,7 +5,7 @@ import {
   type Policy,
 } from "../sandbox/policy/loader";
 import { PolicyEnforcer } from "../sandbox/policy/enforcer";
-import { MsgType } from "../ipc/protocol";
+import { MsgType, PolicyCheck } from "../ipc/protocol";
 import {
   buildOpenPolicy,
   buildPolicySetMeta,
@@ -122,6 +122,7 @@ export class Supervisor {
         },
         (type, payload) => this.handlePolicyCheck(type, payload)
       );
+      this.publishPolicyChecks();
 
       this.ipcServer.setOnStateChange((state, signal, data) => {
         if (signal === "WORKER_EVENT" && state === "exec_start") {
@@ -214,6 +215,7 @@ export class Supervisor {
       },
       (type, payload) => this.handlePolicyCheck(type, payload)
     );
+    this.publishPolicyChecks();
 
     const workerCommand = this.buildWorkerCommand();
     
@@ -291,6 +293,17 @@ export class Supervisor {
     return meta;
   }
 
+  private publishPolicyChecks() {
+    // Without an enforcer every check is allowed, so the worker can skip them.
+    const enforcer = this.enforcer;
+    let mask = 0;
+    if (enforcer?.needsCheck("fs")) mask |= PolicyCheck.FS;
+    if (enforcer?.needsCheck("net")) mask |= PolicyCheck.NET;
+    if (enforcer?.needsCheck("exec")) mask |= PolicyCheck.EXEC;
+    if (enforcer?.hasWarnActions()) mask |= PolicyCheck.AUDIT;
+    this.ipcServer?.setPolicyChecks(mask);
+  }
+
   private handlePolicyCheck(type: MsgType, payload: Uint8Array): { allowed: boolean } {
     if (!this.enforcer) return { allowed: true };
 
@@ -374,6 +387,7 @@ export class Supervisor {
     if (this.activePolicy) {
         this.enforcer = new PolicyEnforcer(this.activePolicy);
     }
+    this.publishPolicyChecks();
     if (this.activePolicy?.audit?.enabled) {
       this.emit({
         type: "audit-enabled",
@@ -1,14 +1,14 @@
 import { describe, expect, test } from "bun:test";
 import { ptr } from "bun:ffi";
 import { SharedRingBuffer } from "../../ipc/ringbuffer";
+import { RING_HEADER_SIZE } from "../../ipc/protocol";
 
-const HEADER_SIZE = 64;
-
-function createRing(size = 256) {
+function createRing(capacity = 192) {
+    const size = capacity + RING_HEADER_SIZE;
     const backing = new Uint8Array(size);
     const address = Number(ptr(backing));
     const ring = new SharedRingBuffer(address, size);
-    ring.capacity = size - HEADER_SIZE;
+    ring.capacity = capacity;
     ring.head = 0;
     ring.tail = 0;
     return { ring, backing };
@@ -32,14 +32,14 @@ describe("SharedRingBuffer", () => {
     });
 
     test("returns 0 when full", () => {
-        const { ring } = createRing(96);
+        const { ring } = createRing(32);
         const payload = new Uint8Array(40);
         const written = ring.write(payload);
         expect(written).toBe(0);
     });
 
     test("handles wraparound", () => {
-        const { ring } = createRing(256);
+        const { ring } = createRing(192);
         ring.head = ring.capacity - 12;
         ring.tail = ring.capacity - 12;
         const payload = new Uint8Array(20).fill(7);
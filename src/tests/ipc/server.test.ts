@@ -104,6 +104,27 @@ describe("IPCServer", () => {
         server.stop();
     });
 
+    test("handleData answers policy checks before draining output", () => {
+        const order: string[] = [];
+        const server = new IPCServer(
+            "/ipc-test",
+            1024,
+            () => order.push("stdout"),
+            (type) => {
+                order.push(`check ${type}`);
+                return { allowed: true };
+            },
+        );
+
+        server.py2bun.write(new Uint8Array([0, 0, 0, 0, 0, 104, 105]));
+        server.py2bunCtrl.write(new Uint8Array([2, 7, 0, 0, 0, 47]));
+        server.handleData();
+
+        expect(order).toEqual(["check 2", "stdout"]);
+        expect(Array.from(server.bun2py.read() ?? [])).toEqual([0x10, 7, 0, 0, 0]);
+        server.stop();
+    });
+
     test("send returns false when ring buffer is full", () => {
         const server = new IPCServer("/ipc-test", 1024);
         FakeSharedRingBuffer.nextWriteResult = 0;
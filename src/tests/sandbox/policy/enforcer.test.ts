@@ -0,0 +1,119 @@
+import { describe, expect, test } from "bun:test";
+import { PolicyEnforcer } from "../../../sandbox/policy/enforcer";
+import type { NormalizedPolicy } from "../../../sandbox/policy/loader";
+
+const policy: NormalizedPolicy = {
+    version: 1,
+    plugins: { namespaces: true, landlock: true, seccomp: true },
+    defaults: { fs: "deny", net: "deny", exec: "deny" },
+    fs: {
+        rules: [
+            { action: "allow", path: "/tmp", perms: ["read_file", "write_file"] },
+            { action: "deny", path: "/tmp/secret", perms: ["read_file"] },
+            { action: "warn", path: "/var/log", perms: ["read_file"] },
+        ],
+    },
+    net: {
+        rules: [
+            { action: "allow", proto: "tcp", cidr: "10.0.0.0/8", ports: [{ from: 443, to: 443 }] },
+            { action: "warn", proto: "tcp", cidr: "10.1.2.3/16", ports: [{ from: 5432, to: 5432 }] },
+            { action: "deny", proto: "tcp", cidr: "10.9.0.0/16", ports: [{ from: 0, to: 65535 }] },
+            { action: "allow", proto: "udp", cidr: "0.0.0.0/0", ports: [{ from: 53, to: 53 }] },
+        ],
+    },
+    exec: {
+        rules: [
+            { action: "allow", path: "/usr/bin/python3" },
+            { action: "warn", path: "/bin/ls" },
+            { action: "deny", path: "/bin/ls" },
+        ],
+    },
+};
+
+describe("PolicyEnforcer", () => {
+    const enforcer = new PolicyEnforcer(policy);
+
+    test("fs rules match by prefix and permission, deny wins", () => {
+        expect(enforcer.checkFs("/tmp/file.txt", "read_file")).toBe("allow");
+        expect(enforcer.checkFs("/tmp/secret/key", "read_file")).toBe("deny");
+        expect(enforcer.checkFs("/tmp/secret/key", "write_file")).toBe("allow");
+        expect(enforcer.checkFs("/var/log/syslog", "read_file")).toBe("warn");
+        expect(enforcer.checkFs("/etc/passwd", "read_file")).toBe("deny");
+        expect(enforcer.checkFs("/tmp/../etc/passwd", "read_file")).toBe("deny");
+        expect(enforcer.checkFs("/tmp/./secret/key", "read_file")).toBe("deny");
+        expect(enforcer.checkFs("/tmp//secret/key", "read_file")).toBe("deny");
+        expect(enforcer.checkFs("/var/log/", "read_file")).toBe("warn");
+    });
+
+    test("net rules match CIDR, proto and port", () => {
+        expect(enforcer.checkNet("10.20.30.40", 443, "tcp")).toBe("allow");
+        expect(enforcer.checkNet("10.20.30.40", 80, "tcp")).toBe("deny");
+        expect(enforcer.checkNet("10.1.200.1", 5432, "tcp")).toBe("warn");
+        expect(enforcer.checkNet("10.9.1.1", 443, "tcp")).toBe("deny");
+        expect(enforcer.checkNet("8.8.8.8", 53, "udp")).toBe("allow");
+        expect(enforcer.checkNet("8.8.8.8", 53, "tcp")).toBe("deny");
+        expect(enforcer.checkNet("localhost", 443, "tcp")).toBe("deny");
+    });
+
+    test("IPv6 rules never match IPv4 addresses", () => {
+        const v6 = new PolicyEnforcer({
+            ...policy,
+            net: {
+                rules: [
+                    { action: "allow", proto: "tcp", cidr: "::/0", ports: [{ from: 0, to: 65535 }] },
+                ],
+            },
+        });
+        expect(v6.checkNet("8.8.8.8", 443, "tcp")).toBe("deny");
+        expect(v6.checkNet("0.0.0.0", 443, "tcp")).toBe("deny");
+    });
+
+    test("exec rules resolve to the strongest action per path", () => {
+        expect(enforcer.checkExec("/usr/bin/python3")).toBe("allow");
+        expect(enforcer.checkExec("/bin/ls")).toBe("deny");
+        expect(enforcer.checkExec("/bin/sh")).toBe("deny");
+    });
+
+    test("falls back to defaults when a section has no rules", () => {
+        const open = new PolicyEnforcer({
+            ...policy,
+            defaults: { fs: "allow", net: "allow", exec: "allow" },
+            fs: undefined,
+            net: undefined,
+            exec: undefined,
+        });
+        expect(open.checkFs("/etc/passwd", "read_file")).toBe("allow");
+        expect(open.checkNet("1.2.3.4", 80, "tcp")).toBe("allow");
+        expect(open.checkExec("/bin/sh")).toBe("allow");
+    });
+
+    test("reports which kinds need worker checks", () => {
+        expect(enforcer.needsCheck("fs")).toBe(true);
+        const open = new PolicyEnforcer({
+            ...policy,
+            defaults: { fs: "allow", net: "allow", exec: "deny" },
+            fs: { rules: [] },
+            net: undefined,
+            exec: undefined,
+        });
+        expect(open.needsCheck("fs")).toBe(false);
+        expect(open.needsCheck("net")).toBe(false);
+        expect(open.needsCheck("exec")).toBe(true);
+    });
+
+    test("reports whether any action is warn", () => {
+        expect(enforcer.hasWarnActions()).toBe(true);
+        const strict: NormalizedPolicy = {
+            ...policy,
+            fs: undefined,
+            net: undefined,
+            exec: { rules: [{ action: "allow", path: "/bin/ls" }] },
+        };
+        expect(new PolicyEnforcer(strict).hasWarnActions()).toBe(false);
+        const warnDefault = new PolicyEnforcer({
+            ...strict,
+            defaults: { fs: "deny", net: "warn", exec: "deny" },
+        });
+        expect(warnDefault.hasWarnActions()).toBe(true);
+    });
+});
@@ -0,0 +1,70 @@
+import { describe, expect, test } from "bun:test";
+import { mkdtempSync, rmSync } from "node:fs";
+import { tmpdir } from "node:os";
+import { join } from "node:path";
+import { PolicyLoader, type Policy } from "../../../sandbox/policy/loader";
+
+const basePolicy: Policy = {
+    version: 1,
+    plugins: { namespaces: true, landlock: true, seccomp: true },
+    defaults: { fs: "deny", net: "deny", exec: "deny" },
+    net: {
+        rules: [
+            { action: "allow", proto: "tcp", cidr: "10.0.0.0/8", ports: "80,8000-8080" },
+        ],
+    },
+};
+
+describe("PolicyLoader", () => {
+    test("reuses the parsed policy until the file changes", async () => {
+        const dir = mkdtempSync(join(tmpdir(), "policy-loader-"));
+        const policyPath = join(dir, "policy.json");
+        try {
+            await Bun.write(policyPath, JSON.stringify(basePolicy));
+            const first = await new PolicyLoader().load(policyPath);
+            const second = await new PolicyLoader().load(policyPath);
+            expect(second).toBe(first);
+            expect(first.net?.rules[0]?.ports).toEqual([
+                { from: 80, to: 80 },
+                { from: 8000, to: 8080 },
+            ]);
+
+            await Bun.write(policyPath, JSON.stringify({
+                ...basePolicy,
+                defaults: { fs: "allow", net: "deny", exec: "deny" },
+            }));
+            const third = await new PolicyLoader().load(policyPath);
+            expect(third).not.toBe(first);
+            expect(third.defaults.fs).toBe("allow");
+        } finally {
+            rmSync(dir, { recursive: true, force: true });
+        }
+    });
+
+    test("reloads a same-size rewrite and freezes the shared policy", async () => {
+        const dir = mkdtempSync(join(tmpdir(), "policy-loader-"));
+        const policyPath = join(dir, "policy.json");
+        const withAction = (action: "warn" | "deny"): Policy => ({
+            ...basePolicy,
+            net: { rules: [{ ...basePolicy.net!.rules[0]!, action }] },
+        });
+        try {
+            await Bun.write(policyPath, JSON.stringify(withAction("warn")));
+            const first = await new PolicyLoader().load(policyPath);
+            expect(Object.isFrozen(first.net?.rules[0]?.ports)).toBe(true);
+
+            // Same length, written back to back: stat fields alone may not change.
+            await Bun.write(policyPath, JSON.stringify(withAction("deny")));
+            const second = await new PolicyLoader().load(policyPath);
+            expect(second.net?.rules[0]?.action).toBe("deny");
+        } finally {
+            rmSync(dir, { recursive: true, force: true });
+        }
+    });
+
+    test("throws when the policy file is missing", async () => {
+        await expect(new PolicyLoader().load("/nonexistent/policy.json")).rejects.toThrow(
+            "Policy file not found",
+        );
+    });
+});
@@ -0,0 +1,438 @@
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import worker  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def python_ring(monkeypatch):
+    # Exercise the pure-Python ring even when libshm.so is around.
+    monkeypatch.setattr(worker, "_NATIVE_RING", None)
+
+
+@pytest.fixture
+def sock():
+    a, b = socket.socketpair()
+    yield a
+    a.close()
+    b.close()
+
+
+def make_ring(capacity=64, generation=0, checks=0):
+    buf = bytearray(worker.RING_HEADER_SIZE + capacity)
+    struct.pack_into("<I", buf, worker.CAPACITY_OFFSET, capacity)
+    struct.pack_into("<I", buf, worker.POLICY_GENERATION_OFFSET, generation)
+    buf[worker.POLICY_CHECKS_OFFSET] = checks
+    return buf, worker.SharedRingBuffer(buf, 0, len(buf))
+
+
+def drain(ring):
+    msgs = []
+    while (msg := ring.read()) is not None:
+        msgs.append(msg)
+    return msgs
+
+
+def test_ring_frames_survive_wrap_around():
+    _, ring = make_ring(64)
+    # 23-byte frames against a 64-byte ring land on every wrap offset.
+    for i in range(40):
+        payload = bytes([i]) * 19
+        assert ring.write(payload)
+        assert ring.read() == payload
+    assert ring.empty()
+
+    assert ring.write(b"abc", b"\x01\x02") == 5
+    assert ring.write(b"def")
+    assert ring.read_batch(8) == [b"\x01\x02abc", b"def"]
+
+
+def test_ring_rejects_frames_that_do_not_fit():
+    _, ring = make_ring(64)
+    assert ring.write(b"x" * 60) == 0
+    assert ring.write(b"x" * 59)
+    assert ring.write(b"y") == 0
+
+
+def test_shm_out_keeps_utf8_sequences_whole(sock):
+    _, ring = make_ring(256)
+    out = worker.ShmOut(ring, sock)
+    text = "aé€😀" * 40
+    data = text.encode("utf-8")
+
+    received = []
+    # 7-byte writes cut through multibyte sequences at varying offsets.
+    for cut in range(0, len(data), 7):
+        out.write(data[cut : cut + 7])
+        received.extend(drain(ring))
+
+    frames = [msg[5:] for msg in received]
+    assert all(msg[:5] == b"\x00" * 5 for msg in received)
+    assert all(len(frame) <= out._chunk for frame in frames)
+    assert "".join(frame.decode("utf-8") for frame in frames) == text
+
+
+def test_shm_out_splits_large_writes_into_chunks(sock):
+    _, ring = make_ring(64)
+    out = worker.ShmOut(ring, sock)
+    text = "é" * 100
+    frames = []
+    # The ring only holds one chunk, so read after each write.
+    data = text.encode("utf-8")
+    for cut in range(0, len(data), out._chunk):
+        out.write(data[cut : cut + out._chunk])
+        frames.extend(msg[5:] for msg in drain(ring))
+    assert all(len(frame) <= out._chunk for frame in frames)
+    assert "".join(frame.decode("utf-8") for frame in frames) == text
+
+
+def test_shm_out_flush_emits_an_incomplete_sequence(sock):
+    _, ring = make_ring(256)
+    out = worker.ShmOut(ring, sock)
+    out.write(b"ab\xe2\x82")
+    out.flush()
+    frames = [msg[5:] for msg in drain(ring)]
+    assert b"".join(frames).decode("utf-8") == "ab\ufffd"
+    assert out._carry == b""
+
+
+def test_compile_code_splits_eval_and_exec(monkeypatch):
+    monkeypatch.setattr(worker, "_CODE_CACHE", worker.OrderedDict())
+
+    code, mode = worker.compile_code(b"expr", "1 + 2")
+    assert mode == "eval"
+    assert eval(code, {}) == 3
+
+    code, mode = worker.compile_code(b"stmt", "x = 1\nx + 1")
+    assert mode == "exec"
+    namespace = {}
+    assert eval(code, namespace) is None
+    assert namespace["x"] == 1
+
+
+def test_compile_code_reuses_and_evicts_cached_cells(monkeypatch):
+    monkeypatch.setattr(worker, "_CODE_CACHE", worker.OrderedDict())
+    monkeypatch.setattr(worker, "CODE_CACHE_SIZE", 2)
+
+    first = worker.compile_code(b"a", "1")
+    assert worker.compile_code(b"a", "1") is first
+
+    worker.compile_code(b"b", "2")
+    worker.compile_code(b"a", "1")  # refreshes "a"
+    worker.compile_code(b"c", "3")  # evicts "b"
+    assert list(worker._CODE_CACHE) == [b"a", b"c"]
+
+
+def test_compile_code_skips_caching_large_sources(monkeypatch):
+    monkeypatch.setattr(worker, "_CODE_CACHE", worker.OrderedDict())
+    monkeypatch.setattr(worker, "CODE_CACHE_MAX_SOURCE", 4)
+    worker.compile_code(b"big", "12345")
+    assert not worker._CODE_CACHE
+
+
+def test_parse_cell_hashes_and_decodes_code():
+    payload = "print('é')".encode("utf-8")
+    msg = bytes([worker.MSG_TYPE_CODE]) + b"\x00" * 4 + payload
+    msg_type, key, code = worker.parse_cell(msg)
+    assert msg_type == worker.MSG_TYPE_CODE
+    assert code == "print('é')"
+    assert worker.parse_cell(msg)[1] == key
+    assert worker.parse_cell(b"\x10\x00\x00\x00\x00") == (0x10, None, None)
+
+
+def make_client(sock, monkeypatch, checks=0):
+    buf, bun2py = make_ring(generation=1, checks=checks)
+    _, py2bun = make_ring(256)
+    client = worker.PolicyClient(bun2py, py2bun, sock)
+    requests = []
+
+    def request(type_code, payload_bytes):
+        requests.append(payload_bytes)
+        return worker.RESP_DENY if payload_bytes == b"/deny" else worker.RESP_ALLOW
+
+    monkeypatch.setattr(client, "_request", request)
+
+    def bump_generation():
+        generation = struct.unpack_from("<I", buf, worker.POLICY_GENERATION_OFFSET)[0]
+        struct.pack_into("<I", buf, worker.POLICY_GENERATION_OFFSET, generation + 1)
+
+    return client, requests, bump_generation, py2bun
+
+
+def test_policy_verdicts_are_cached_per_generation(sock, monkeypatch):
+    client, requests, bump_generation, _ = make_client(sock, monkeypatch)
+
+    assert client.check(worker.MSG_TYPE_FS_WRITE, b"/ok")
+    assert client.check(worker.MSG_TYPE_FS_WRITE, b"/ok")
+    assert not client.check(worker.MSG_TYPE_FS_WRITE, b"/deny")
+    assert not client.check(worker.MSG_TYPE_FS_WRITE, b"/deny")
+    assert requests == [b"/ok", b"/deny"]
+
+    bump_generation()
+    assert client.check(worker.MSG_TYPE_FS_WRITE, b"/ok")
+    assert requests == [b"/ok", b"/deny", b"/ok"]
+
+
+def test_policy_reports_are_sent_once_per_generation(sock, monkeypatch):
+    client, _, bump_generation, py2bun = make_client(sock, monkeypatch)
+
+    client.report(worker.MSG_TYPE_FS_READ, b"/etc")
+    client.report(worker.MSG_TYPE_FS_READ, b"/etc")
+    assert [msg[5:] for msg in drain(py2bun)] == [b"/etc"]
+    assert client.take_notice() == b"CHECK\n"
+    assert client.take_notice() == b""
+
+    bump_generation()
+    client.report(worker.MSG_TYPE_FS_READ, b"/etc")
+    assert [msg[5:] for msg in drain(py2bun)] == [b"/etc"]
+
+
+def test_policy_audit_bypasses_the_caches(sock, monkeypatch):
+    client, requests, _, py2bun = make_client(
+        sock, monkeypatch, checks=worker.POLICY_CHECK_AUDIT
+    )
+
+    client.check(worker.MSG_TYPE_EXEC, b"/bin/ls")
+    client.check(worker.MSG_TYPE_EXEC, b"/bin/ls")
+    assert requests == [b"/bin/ls", b"/bin/ls"]
+
+    client.report(worker.MSG_TYPE_LISTDIR, b"/tmp")
+    client.report(worker.MSG_TYPE_LISTDIR, b"/tmp")
+    assert len(drain(py2bun)) == 2
+
+
+WORKER_PATH = os.path.join(os.path.dirname(__file__), "..", "worker.py")
+END_EVENTS = {"exec_end", "exception", "interrupted"}
+SYNC_TYPES = {
+    worker.MSG_TYPE_FS_WRITE,
+    worker.MSG_TYPE_EXEC,
+    worker.MSG_TYPE_NET_CONNECT,
+}
+
+
+class FakeSupervisor:
+    """Runs worker.py against a real segment and allows every policy check.
+
+    Socket lines are logged in arrival order, each end event together with
+    the stdout that had reached the ring when it arrived.
+    """
+
+    def __init__(self, tmp_path, checks=0, capacity=4096):
+        self.ring_size = worker.RING_HEADER_SIZE + capacity
+        size = self.ring_size * 3
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        for i in range(3):
+            struct.pack_into(
+                "<I",
+                self.shm.buf,
+                i * self.ring_size + worker.CAPACITY_OFFSET,
+                capacity,
+            )
+        self.shm.buf[worker.POLICY_CHECKS_OFFSET] = checks
+        self.bun2py, self.py2bun, self.py2bun_ctrl = (
+            worker.SharedRingBuffer(self.shm.buf, i * self.ring_size, self.ring_size)
+            for i in range(3)
+        )
+
+        path = str(tmp_path / "worker.sock")
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(1)
+        env = dict(os.environ, LIBSHM_PATH="")
+        self.proc = subprocess.Popen(
+            [sys.executable, WORKER_PATH, path, self.shm.name, str(size)],
+            cwd=str(tmp_path),
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.server.settimeout(10)
+        self.conn, _ = self.server.accept()
+        self.conn.settimeout(0.05)
+        self._pending = b""
+        self.log = []
+        self.output = b""
+        self.answered = 0
+        self.pump(lambda: "READY" in self.log)
+
+    def _drain_output(self):
+        for msg in drain(self.py2bun):
+            self.output += msg[5:]
+
+    def _answer_checks(self):
+        for msg in drain(self.py2bun_ctrl):
+            msg_type, req_id = worker._MSG_HEADER.unpack_from(msg)
+            self.log.append(("check", msg_type, msg[5:]))
+            if msg_type in SYNC_TYPES:
+                self.bun2py.write(
+                    b"", worker._MSG_HEADER.pack(worker.RESP_ALLOW, req_id)
+                )
+                self.conn.sendall(b"WAKE\n")
+                self.answered += 1
+
+    def pump(self, done, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while not done():
+            assert time.monotonic() < deadline, f"timed out; log={self.log}"
+            self._answer_checks()
+            try:
+                data = self.conn.recv(4096)
+            except socket.timeout:
+                continue
+            if not data:
+                break
+            self._pending += data
+            *lines, self._pending = self._pending.split(b"\n")
+            for line in lines:
+                if line in (b"READY", b"DATA", b"CHECK"):
+                    self.log.append(line.decode())
+                    self._answer_checks()
+                    continue
+                event = json.loads(line)["event"]
+                if event in END_EVENTS:
+                    self._drain_output()
+                    self.log.append((event, self.output))
+                else:
+                    self.log.append(event)
+
+    def run(self, code, timeout=10.0):
+        """Send one cell and wait for its end event; returns that log entry."""
+        ends = sum(1 for entry in self.log if entry[0] in END_EVENTS)
+        header = worker._MSG_HEADER.pack(worker.MSG_TYPE_CODE, 0)
+        assert self.bun2py.write(code.encode("utf-8"), header)
+        self.conn.sendall(b"WAKE\n")
+        self.pump(
+            lambda: sum(1 for entry in self.log if entry[0] in END_EVENTS) > ends,
+            timeout,
+        )
+        # Lines after the end event (the traceback's DATA) may share its recv.
+        return [entry for entry in self.log if entry[0] in END_EVENTS][-1]
+
+    def close(self):
+        self.conn.close()
+        self.server.close()
+        try:
+            _, stderr = self.proc.communicate(timeout=10)
+            self._drain_output()
+        finally:
+            self.proc.kill()
+            for ring in (self.bun2py, self.py2bun, self.py2bun_ctrl):
+                ring.close()
+            self.shm.close()
+            self.shm.unlink()
+        return stderr
+
+
+@pytest.fixture
+def supervisor(tmp_path):
+    started = []
+
+    def start(**kwargs):
+        started.append(FakeSupervisor(tmp_path, **kwargs))
+        return started[-1]
+
+    yield start
+    for sup in started:
+        if sup.proc.poll() is None:
+            sup.close()
+
+
+def test_worker_runs_cells_and_streams_output(supervisor):
+    sup = supervisor()
+    assert sup.run("print('hi')\n1 + 1") == ("exec_end", b"hi\n")
+    assert sup.run("2 * 21") == ("exec_end", b"hi\n42\n")
+    assert "code_received" in sup.log and "exec_start" in sup.log
+    sup.close()
+
+
+def test_guest_thread_checks_while_main_loop_idles(supervisor, tmp_path):
+    sup = supervisor(checks=worker.POLICY_CHECK_FS)
+    target = str(tmp_path / "out")
+    sup.run(
+        "import threading\n"
+        "results = []\n"
+        "def work():\n"
+        "    for i in range(20):\n"
+        "        try:\n"
+        f"            with open({target!r} + str(i), 'w'):\n"
+        "                results.append('ok')\n"
+        "        except PermissionError as e:\n"
+        "            results.append(repr(e))\n"
+        "t = threading.Thread(target=work)\n"
+        "t.start()\n"
+    )
+    start = time.monotonic()
+    # The main loop sits idle while the thread's checks are answered.
+    sup.pump(lambda: sup.answered >= 20, timeout=worker.POLICY_TIMEOUT)
+    _, output = sup.run("t.join()\nprint(results)")
+    assert output.endswith(repr(["ok"] * 20).encode() + b"\n")
+    assert time.monotonic() - start < worker.POLICY_TIMEOUT
+    sup.close()
+
+
+def test_read_cells_waits_for_an_outstanding_request(sock):
+    _, bun2py = make_ring(256)
+    _, py2bun = make_ring(256)
+    client = worker.PolicyClient(bun2py, py2bun, sock)
+    response = worker._MSG_HEADER.pack(worker.RESP_ALLOW, 7)
+
+    # _request holds the lock from posting a check until its verdict arrives.
+    with client._lock:
+        bun2py.write(b"", response)
+        reader = threading.Thread(target=client.read_cells, args=(64,))
+        reader.start()
+        reader.join(0.05)
+        assert reader.is_alive()
+        assert bun2py.read() == response
+    reader.join()
+    assert not client.inbox
+
+
+def test_cells_restore_stdout_but_leave_stderr_alone(supervisor):
+    sup = supervisor()
+    sup.run(
+        "import sys\nprint('err', file=sys.stderr)\nsys.stdout = open('/dev/null', 'w')"
+    )
+    assert sup.run("print('out')") == ("exec_end", b"out\n")
+    stderr = sup.close()
+    assert b"err" not in sup.output
+    assert b"err\n" in stderr
+
+
+def test_exception_output_arrives_before_the_exception_event(supervisor):
+    sup = supervisor()
+    # A slow __str__ holds back the traceback printed after the event.
+    code = (
+        "import time\n"
+        "class Slow(Exception):\n"
+        "    def __str__(self):\n"
+        "        time.sleep(0.2)\n"
+        "        return 'slow'\n"
+        "print('a', end='')\n"
+        "raise Slow()"
+    )
+    assert sup.run(code) == ("exception", b"a")
+    sup.close()
+
+
+def test_reports_are_signalled_before_a_failing_cell_ends(supervisor, tmp_path):
+    (tmp_path / "data.txt").write_text("x")
+    sup = supervisor(checks=worker.POLICY_CHECK_FS)
+    event, output = sup.run("print(open('data.txt').read(), end='')\nraise KeyError(1)")
+    assert event == "exception"
+    assert output.startswith(b"x")
+    end = next(i for i, entry in enumerate(sup.log) if entry[0] == "exception")
+    assert ("check", worker.MSG_TYPE_FS_READ, b"data.txt") in sup.log[:end]
+    assert "CHECK" in sup.log[:end]
+    sup.close()
@@ -1,5 +1,6 @@
 import { shmOpen, mmap, munmap, close } from "./ipc/ffi";
 import { SharedRingBuffer } from "./ipc/ringbuffer";
+import { RING_HEADER_SIZE } from "./ipc/protocol";
 
 const argv = Bun.argv;
 if (argv.length < 5) {
@@ -35,15 +36,16 @@ if (!shmPtr) {
   process.exit(1);
 }
 
-const ringSize = Math.floor(shmSize / 2);
+// The third ring carries policy checks, which this worker does not send.
+const ringSize = Math.floor(shmSize / 3);
 const bun2worker = new SharedRingBuffer(shmPtr, ringSize);
 const worker2bun = new SharedRingBuffer(shmPtr + ringSize, ringSize);
 
 if (bun2worker.capacity === 0) {
-  bun2worker.capacity = ringSize - 64;
+  bun2worker.capacity = ringSize - RING_HEADER_SIZE;
 }
 if (worker2bun.capacity === 0) {
-  worker2bun.capacity = ringSize - 64;
+  worker2bun.capacity = ringSize - RING_HEADER_SIZE;
 }
 
 const encoder = new TextEncoder();
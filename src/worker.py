@@ -1,18 +1,27 @@
 import socket
+import select
 import sys
 import struct
 import time
 import io
+import ast
 import traceback
 import json
 import builtins
+import ctypes
 import subprocess
-import ipaddress
 import os
+import hashlib
+import threading
+from collections import OrderedDict, deque
 from multiprocessing import shared_memory
 from multiprocessing.resource_tracker import unregister
 from typing import Any
-from contextlib import contextmanager
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Protocol Constants
 MSG_TYPE_STDOUT = 0x00
@@ -26,101 +35,304 @@ MSG_TYPE_CODE = 0x20
 RESP_ALLOW = 0x10
 RESP_DENY = 0x11
 
+# Policy-checks bits the supervisor publishes in the bun2py header.
+POLICY_CHECK_FS = 0x01
+POLICY_CHECK_NET = 0x02
+POLICY_CHECK_EXEC = 0x04
+# Set while some action is "warn": the supervisor logs those per operation.
+POLICY_CHECK_AUDIT = 0x08
+
+# Idle poll ladder: busy-spin, then yield, then block on the socket doorbell.
+IDLE_SPIN_LIMIT = 64
+IDLE_YIELD_LIMIT = 256
+IDLE_WAIT = 0.05
+
+# Seconds a sync policy check waits for the supervisor's verdict.
+POLICY_TIMEOUT = 5.0
+
+# Most bun2py messages the main loop pulls out of the ring per head update.
+READ_BATCH = 64
+
+# Compiled code objects kept for re-sent cells; larger sources are not cached.
+CODE_CACHE_SIZE = 256
+CODE_CACHE_MAX_SOURCE = 64 * 1024
+
+# Policy verdicts (and already-sent reports) kept per policy generation.
+DECISION_CACHE_SIZE = 1024
+
+# Stdout notification coalescing thresholds.
+NOTIFY_BYTES = 64 * 1024
+NOTIFY_INTERVAL = 0.001
+
+# Frames shown when a cell raises.
+WORKER_TB_LIMIT = int(os.environ.get("WORKER_TB_LIMIT", "5"))
+
+# Largest stdout payload sent in a single ring frame.
+STDOUT_CHUNK = 64 * 1024
+# Guest stdout is buffered in C and handed to ShmOut at each newline, or in
+# blocks this size for long unterminated writes.
+STDOUT_BUFFER = 64 * 1024
+
+
+# Initial size of the scratch buffer native reads copy into; grown on demand.
+NATIVE_SCRATCH = 64 * 1024
+
+
+def _load_native_ring():
+    """Load the C ring helpers from libshm.so, or None to stay in Python."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    candidates = [
+        os.environ.get("LIBSHM_PATH"),
+        os.path.join(os.getcwd(), "libshm.so"),
+        os.path.join(here, "..", "libshm.so"),
+    ]
+    for path in candidates:
+        if not path or not os.path.exists(path):
+            continue
+        try:
+            lib = ctypes.CDLL(path)
+            write = lib.ipc_ring_write
+            read = lib.ipc_ring_read
+        except (OSError, AttributeError):
+            # Missing, unloadable, or built before the ring helpers existed.
+            continue
+        write.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        write.restype = ctypes.c_uint32
+        read.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint32]
+        read.restype = ctypes.c_int64
+        return lib
+    return None
+
+
+_NATIVE_RING = _load_native_ring()
+
+# Ring header layout. The consumer-owned head, the producer-owned tail and
+# the fields written once at startup each sit on their own cache line.
+RING_HEADER_SIZE = 192
+HEAD_OFFSET = 0
+TAIL_OFFSET = 64
+PENDING_OFFSET = 68
+CAPACITY_OFFSET = 128
+POLICY_CHECKS_OFFSET = 132
+POLICY_GENERATION_OFFSET = 136
+
+# Length prefixes inside the data region.
+_U32 = struct.Struct("<I")
+# Message header: [Type: 1][ReqID: 4].
+_MSG_HEADER = struct.Struct("<BI")
+
 
 class SharedRingBuffer:
     def __init__(self, shm_buf, offset, size):
         self.buf = shm_buf
         self.offset = offset
         self.total_size = size
-        self.header_size = 64
-        self.capacity_offset = 8
+        self.header_size = RING_HEADER_SIZE
+        self.capacity_offset = CAPACITY_OFFSET
+        self.pending_offset = PENDING_OFFSET
+        self.policy_checks_offset = POLICY_CHECKS_OFFSET
+        # Byte view over the data region so ring offsets index it directly.
+        self._mv = memoryview(shm_buf)[offset + self.header_size : offset + size].cast(
+            "B"
+        )
+        # head and tail as native u32 views; the header is little-endian,
+        # which is every platform the supervisor runs on.
+        if sys.byteorder != "little":
+            raise ValueError("shared ring header requires a little-endian host")
+        self._head = self._u32_view(shm_buf, offset + HEAD_OFFSET)
+        self._tail = self._u32_view(shm_buf, offset + TAIL_OFFSET)
+        self._policy_generation = self._u32_view(
+            shm_buf, offset + POLICY_GENERATION_OFFSET
+        )
+        # Capacity is written once by the supervisor before the worker starts.
+        self._cap = _U32.unpack_from(shm_buf, offset + self.capacity_offset)[0]
+        # The supervisor sizes each ring to a power of two so offsets can be
+        # wrapped with a mask instead of a modulo.
+        if self._cap <= 0 or self._cap & (self._cap - 1):
+            raise ValueError(f"ring capacity must be a power of two, got {self._cap}")
+        self._mask = self._cap - 1
+        self._write_lock = threading.Lock()
+
+        # With libshm.so available, whole-message reads and bytes writes go
+        # through C with acquire/release ordering on head and tail.
+        self._native = _NATIVE_RING
+        self._cring = None
+        if self._native is not None:
+            self._cring = (ctypes.c_ubyte * size).from_buffer(shm_buf, offset)
+            self._ring_ptr = ctypes.addressof(self._cring)
+            self._grow_scratch(min(NATIVE_SCRATCH, self._cap))
+
+    @property
+    def capacity(self):
+        return self._cap
+
+    def close(self):
+        # Release the exported views so SharedMemory.close() can unmap.
+        self._mv.release()
+        self._head.release()
+        self._tail.release()
+        self._policy_generation.release()
+        self._cring = None
+
+    @staticmethod
+    def _u32_view(shm_buf, offset):
+        return memoryview(shm_buf)[offset : offset + 4].cast("B").cast("I")
+
+    def _grow_scratch(self, size):
+        self._scratch = bytearray(size)
+        self._scratch_view = memoryview(self._scratch)
+        self._scratch_c = (ctypes.c_ubyte * size).from_buffer(self._scratch)
+        self._scratch_ptr = ctypes.addressof(self._scratch_c)
+
+    def _head_tail(self):
+        return self._head[0], self._tail[0]
 
     def _read_header(self):
-        base = self.offset
-        head = struct.unpack_from("<I", self.buf, base)[0]
-        tail = struct.unpack_from("<I", self.buf, base + 4)[0]
-        capacity = struct.unpack_from("<I", self.buf, base + 8)[0]
-        return head, tail, capacity
+        head, tail = self._head_tail()
+        return head, tail, self._cap
+
+    def empty(self):
+        return self._head[0] == self._tail[0]
+
+    def mark_pending(self):
+        self.buf[self.offset + self.pending_offset] = 1
+
+    def policy_checks(self):
+        return self.buf[self.offset + self.policy_checks_offset]
+
+    def policy_generation(self):
+        return self._policy_generation[0]
 
     def _write_head(self, val):
-        struct.pack_into("<I", self.buf, self.offset, val)
+        self._head[0] = val
 
     def _write_tail(self, val):
-        struct.pack_into("<I", self.buf, self.offset + 4, val)
-
-    def write(self, data):
-        data_len = len(data)
+        self._tail[0] = val
+
+    def write(self, data, prefix=b""):
+        # Guest threads share the ring for stdout and policy checks, and the
+        # native helper runs without the GIL, so frames are reserved and
+        # published one writer at a time.
+        with self._write_lock:
+            return self._write_frame(data, prefix)
+
+    def _write_frame(self, data, prefix):
+        # Accept any buffer so callers can pass memoryview slices without
+        # materialising a bytes copy first. A prefix (e.g. a message header)
+        # is written in front of data as part of the same frame.
+        if self._cring is not None and type(data) is bytes and type(prefix) is bytes:
+            return self._native.ipc_ring_write(
+                self._ring_ptr, prefix, len(prefix), data, len(data)
+            )
+        data = memoryview(data)
+        prefix_len = len(prefix)
+        data_len = prefix_len + data.nbytes
         head, tail, cap = self._read_header()
 
-        size = (tail - head + cap) % cap
+        size = (tail - head) & self._mask
         available = cap - size - 1
 
         if available < 4 + data_len:
             return 0
 
-        len_bytes = struct.pack("<I", data_len)
-        self._write_raw(len_bytes, tail, cap)
-        tail = (tail + 4) % cap
+        if tail + 4 <= cap:
+            _U32.pack_into(self._mv, tail, data_len)
+        else:
+            self._write_raw(_U32.pack(data_len), tail, cap)
+        tail = (tail + 4) & self._mask
+
+        if prefix_len:
+            self._write_raw(prefix, tail, cap)
+            tail = (tail + prefix_len) & self._mask
 
         self._write_raw(data, tail, cap)
-        tail = (tail + data_len) % cap
+        tail = (tail + data.nbytes) & self._mask
 
         self._write_tail(tail)
         return data_len
 
     def _write_raw(self, bytes_data, start_offset, cap):
-        data_offset = self.offset + self.header_size
         bytes_len = len(bytes_data)
+        end = start_offset + bytes_len
+        if end <= cap:
+            self._mv[start_offset:end] = bytes_data
+            return
 
-        first_chunk = min(bytes_len, cap - start_offset)
-        self.buf[
-            data_offset + start_offset : data_offset + start_offset + first_chunk
-        ] = bytes_data[:first_chunk]
-
-        if first_chunk < bytes_len:
-            remaining = bytes_len - first_chunk
-            self.buf[data_offset : data_offset + remaining] = bytes_data[first_chunk:]
+        # Split through a view so a bytes prefix is not sliced into copies.
+        src = memoryview(bytes_data)
+        first_chunk = cap - start_offset
+        self._mv[start_offset:cap] = src[:first_chunk]
+        self._mv[: bytes_len - first_chunk] = src[first_chunk:]
 
     def read(self):
+        if self._cring is not None:
+            # An empty poll is cheaper as one unpack than a foreign call.
+            if self.empty():
+                return None
+            n = self._native.ipc_ring_read(
+                self._ring_ptr, self._scratch_ptr, len(self._scratch)
+            )
+            if n == -2:
+                self._grow_scratch(self._cap)
+                n = self._native.ipc_ring_read(
+                    self._ring_ptr, self._scratch_ptr, len(self._scratch)
+                )
+            if n < 0:
+                return None
+            return bytes(self._scratch_view[:n])
+
+        msgs = self.read_batch(1)
+        return msgs[0] if msgs else None
+
+    def read_batch(self, max_msgs):
+        """Pop up to max_msgs complete messages, publishing the head once.
+
+        Responses are consumed along with everything else, so on bun2py this
+        is only called through PolicyClient.read_cells.
+        """
         head, tail, cap = self._read_header()
-
-        if head == tail:
-            return None
-
-        size = (tail - head + cap) % cap
+        msgs = []
+        while len(msgs) < max_msgs:
+            frame = self._frame_at(head, tail, cap)
+            if frame is None:
+                break
+            start, msg_len = frame
+            msgs.append(self._read_raw(msg_len, start, cap))
+            head = (start + msg_len) & self._mask
+        if msgs:
+            self._write_head(head)
+        return msgs
+
+    def _frame_at(self, head, tail, cap):
+        # (payload start, payload length) of the frame at head, or None if
+        # no complete frame is there yet.
+        size = (tail - head) & self._mask
         if size < 4:
             return None
 
-        len_bytes = self._read_raw(4, head, cap)
-        msg_len = struct.unpack("<I", len_bytes)[0]
+        if head + 4 <= cap:
+            msg_len = _U32.unpack_from(self._mv, head)[0]
+        else:
+            msg_len = _U32.unpack(self._read_raw(4, head, cap))[0]
 
         if size < 4 + msg_len:
             return None
-
-        head = (head + 4) % cap
-
-        payload = self._read_raw(msg_len, head, cap)
-
-        head = (head + msg_len) % cap
-        self._write_head(head)
-
-        return payload
+        return (head + 4) & self._mask, msg_len
 
     def _read_raw(self, length, start_offset, cap):
-        data_offset = self.offset + self.header_size
-        first_chunk = min(length, cap - start_offset)
-
-        chunk1 = self.buf[
-            data_offset + start_offset : data_offset + start_offset + first_chunk
-        ]
-        result = bytes(chunk1)
-
-        if first_chunk < length:
-            remaining = length - first_chunk
-            chunk2 = self.buf[data_offset : data_offset + remaining]
-            result += bytes(chunk2)
+        end = start_offset + length
+        if end <= cap:
+            return bytes(self._mv[start_offset:end])
 
-        return result
+        first_chunk = cap - start_offset
+        # join() sizes the result once and copies both views straight in.
+        return b"".join((self._mv[start_offset:cap], self._mv[: length - first_chunk]))
 
 
 class PolicyClient:
@@ -129,110 +341,317 @@ class PolicyClient:
         self.py2bun = py2bun
         self.sock = sock
         self.req_id = 1
+        # Guest threads share one request ring and one response ring; a sync
+        # caller must not have its response consumed by another thread.
+        self._lock = threading.Lock()
+        # bun2py messages read off the ring but not yet handled by main().
+        self.inbox = deque()
+        # Verdicts only hold for the policy that produced them; the
+        # supervisor bumps the generation whenever it loads a policy.
+        self._decisions = OrderedDict()
+        self._decisions_generation = None
+        self._decisions_lock = threading.Lock()
+        # Set while optimistic reports sit in the ring without a CHECK.
+        self._unsignalled = False
+
+    def needs_check(self, kind):
+        # Read on every call so a policy change applies to the next operation.
+        return self.bun2py.policy_checks() & kind
+
+    def auditing(self):
+        # Warn verdicts come back as allow, so caching one would skip the
+        # supervisor's audit log for every repeat.
+        return self.bun2py.policy_checks() & POLICY_CHECK_AUDIT
 
     def _next_id(self):
         self.req_id = (self.req_id + 1) & 0xFFFFFFFF
         return self.req_id
 
-    def send_optimistic(self, type_code, payload_bytes):
+    def _post(self, type_code, payload_bytes, notify=True):
+        # Caller holds self._lock. Returns the request id. Without notify the
+        # frame is only flagged pending, for the supervisor's next poll or
+        # the next CHECK/DATA, whichever comes first.
         req_id = self._next_id()
         # [Type: 1][ReqID: 4][Payload: N]
-        header = struct.pack("<BI", type_code, req_id)
-        msg = header + payload_bytes
+        header = _MSG_HEADER.pack(type_code, req_id)
 
         backoff = 0.0001
-        while True:
-            n = self.py2bun.write(msg)
-            if n > 0:
-                break
+        while not self.py2bun.write(payload_bytes, header):
             time.sleep(backoff)
             backoff = min(backoff * 2, 0.001)
 
-        try:
+        if notify:
             self.sock.sendall(b"CHECK\n")
-        except BrokenPipeError:
-            pass
-
-    def send_sync(self, type_code, payload_bytes):
-        req_id = self._next_id()
-        header = struct.pack("<BI", type_code, req_id)
-        msg = header + payload_bytes
-
-        backoff = 0.0001
-        while True:
-            n = self.py2bun.write(msg)
-            if n > 0:
-                break
-            time.sleep(backoff)
-            backoff = min(backoff * 2, 0.001)
+            self._unsignalled = False
+        else:
+            self.py2bun.mark_pending()
+            self._unsignalled = True
+        return req_id
+
+    def read_cells(self, max_msgs):
+        """Move queued bun2py messages into the inbox for main()."""
+        # bun2py and the socket have one reader at a time: while _lock is
+        # held by main() no request is outstanding, so nothing taken here
+        # is a response some thread is waiting for.
+        with self._lock:
+            self.inbox.extend(self.bun2py.read_batch(max_msgs))
+
+    def wait_idle(self, timeout):
+        """Block main() on the socket doorbell, like wait_for_wakeup()."""
+        with self._lock:
+            # A sync request may have parked a cell, and taken its WAKE.
+            if self.inbox or not self.bun2py.empty():
+                return True
+            return wait_for_wakeup(self.sock, timeout)
+
+    def take_notice(self):
+        """Return the CHECK line owed for unsignalled reports and mark it sent.
+
+        Sent ahead of a cell's end event so the supervisor judges the cell's
+        reports before it sees the cell finish. Empty if nothing is owed.
+        """
+        # No lock: a guest thread may hold it for a whole sync round trip, and
+        # a report racing with this only costs one more CHECK later.
+        if not self._unsignalled:
+            return b""
+        self._unsignalled = False
+        return b"CHECK\n"
 
-        try:
-            self.sock.sendall(b"CHECK\n")
-        except BrokenPipeError:
-            return False  # Socket dead
+    def send_optimistic(self, type_code, payload_bytes):
+        with self._lock:
+            # Nothing waits on the verdict, so skip the CHECK syscall.
+            self._post(type_code, payload_bytes, notify=False)
+
+    def check(self, type_code, payload_bytes):
+        """Return whether a sync operation is allowed, reusing earlier verdicts."""
+        if self.auditing():
+            return self.send_sync(type_code, payload_bytes)
+
+        key = (type_code, payload_bytes)
+        generation, allowed = self._recall(key)
+        if allowed is not None:
+            return allowed
+
+        verdict = self._request(type_code, payload_bytes)
+        allowed = verdict == RESP_ALLOW
+        # Timeouts and a dead socket are not verdicts; ask again next time.
+        if verdict is not None:
+            self._remember(key, generation, allowed)
+        return allowed
+
+    def report(self, type_code, payload_bytes):
+        """Send an optimistic report once per operation and policy generation.
+
+        A report the supervisor rejects kills the worker, so one that has
+        been sent before under the same policy was allowed. While warn
+        actions are audited, every report is sent.
+        """
+        if self.auditing():
+            self.send_optimistic(type_code, payload_bytes)
+            return
+
+        key = (type_code, payload_bytes)
+        generation, allowed = self._recall(key)
+        if allowed is None:
+            self.send_optimistic(type_code, payload_bytes)
+            self._remember(key, generation, True)
+
+    def _recall(self, key):
+        generation = self.bun2py.policy_generation()
+        with self._decisions_lock:
+            if generation != self._decisions_generation:
+                self._decisions.clear()
+                self._decisions_generation = generation
+            allowed = self._decisions.get(key)
+            if allowed is not None:
+                self._decisions.move_to_end(key)
+        return generation, allowed
+
+    def _remember(self, key, generation, allowed):
+        with self._decisions_lock:
+            # Drop verdicts that raced with a policy change.
+            if (
+                generation
+                == self._decisions_generation
+                == self.bun2py.policy_generation()
+            ):
+                self._decisions[key] = allowed
+                if len(self._decisions) > DECISION_CACHE_SIZE:
+                    self._decisions.popitem(last=False)
 
-        # Block waiting for response
-        start_time = time.time()
-        while True:
-            resp = self.bun2py.read()
-            if resp is None:
-                if time.time() - start_time > 5.0:
-                    # Timeout
-                    return False
-                time.sleep(0.001)
-                continue
+    def send_sync(self, type_code, payload_bytes):
+        return self._request(type_code, payload_bytes) == RESP_ALLOW
 
-            # [Type: 1][ReqID: 4]
-            if len(resp) < 5:
-                continue
+    def _request(self, type_code, payload_bytes):
+        """Send a check and wait for RESP_ALLOW/RESP_DENY, or None on failure."""
+        with self._lock:
+            try:
+                req_id = self._post(type_code, payload_bytes)
+            except BrokenPipeError:
+                return None  # Socket dead
+
+            # Block waiting for response
+            deadline = time.monotonic() + POLICY_TIMEOUT
+            while True:
+                resp = self.bun2py.read()
+                if resp is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        # Timeout
+                        return None
+                    # The supervisor rings WAKE after queueing the response,
+                    # so sleep on the socket instead of polling.
+                    if not wait_for_wakeup(self.sock, remaining):
+                        return None  # Socket dead
+                    continue
+
+                # [Type: 1][ReqID: 4]
+                if len(resp) < 5:
+                    continue
+
+                r_type, r_req_id = _MSG_HEADER.unpack_from(resp)
+
+                if r_req_id == req_id:
+                    return r_type
+                if r_type == MSG_TYPE_CODE:
+                    # A cell queued while this one runs; keep it for main().
+                    self.inbox.append(resp)
+
+
+def _utf8_tail(data):
+    # Length of an incomplete UTF-8 sequence at the end of data, if any.
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if byte & 0xC0 != 0x80:
+            if byte >= 0xF0:
+                need = 4
+            elif byte >= 0xE0:
+                need = 3
+            elif byte >= 0xC0:
+                need = 2
+            else:
+                need = 1
+            return back if back < need else 0
+    return 0
 
-            r_type = resp[0]
-            r_req_id = struct.unpack_from("<I", resp, 1)[0]
 
-            if r_req_id == req_id:
-                if r_type == RESP_ALLOW:
-                    return True
-                return False
-            else:
-                # Unexpected message (maybe CODE?), ignore or requeue?
-                # In sync mode, we shouldn't receive CODE.
-                pass
+class ShmOut(io.RawIOBase):
+    """Raw byte sink that frames stdout into the py2bun ring.
 
+    The worker wraps it in a line-buffered BufferedWriter/TextIOWrapper, so
+    writes within a line reach the ring as one frame.
+    """
 
-class ShmOut:
     def __init__(self, ring_buffer, sock):
+        super().__init__()
         self.rb = ring_buffer
         self.sock = sock
-
-    def write(self, text):
-        if not text:
-            return 0
-        data = text.encode("utf-8")
-
+        self._notify_pending = False
+        self._unnotified_bytes = 0
+        self._last_notify = 0.0
+        # Bytes of a UTF-8 sequence split across two buffered writes.
+        self._carry = b""
+        # Frames are never larger than the ring can hold in one write.
+        self._chunk = max(1, min(STDOUT_CHUNK, ring_buffer.capacity - 4 - 1 - 5))
         # [Type: 1][ReqID: 4][Data]
         # STDOUT type = 0x00, ReqID = 0 (ignored)
-        header = struct.pack("<BI", MSG_TYPE_STDOUT, 0)
-        full_msg = header + data
+        self._header = _MSG_HEADER.pack(MSG_TYPE_STDOUT, 0)
+
+    def writable(self):
+        return True
 
-        total_written = 0
+    def _notify(self):
+        try:
+            self.sock.sendall(self.take_notice())
+        except OSError:
+            return False
+        return True
+
+    def take_notice(self):
+        """Return the DATA line owed to the supervisor and mark it as sent.
+
+        Lets the caller put the notice in the same socket write as its own
+        message instead of sending it separately. Empty if nothing is owed.
+        """
+        if not self._notify_pending:
+            return b""
+        self._notify_pending = False
+        self._unnotified_bytes = 0
+        self._last_notify = time.monotonic()
+        return b"DATA\n"
+
+    def _chunk_end(self, data, start, stop):
+        end = min(start + self._chunk, stop)
+        if end < stop:
+            # Don't split a UTF-8 sequence: each frame is decoded on its own.
+            cut = end
+            while cut > start and data[cut] & 0xC0 == 0x80:
+                cut -= 1
+            if cut > start:
+                end = cut
+        return end
+
+    def write(self, b):
+        consumed = len(b)
+        if not consumed:
+            return 0
+        if self._carry:
+            b = self._carry + bytes(b)
+            self._carry = b""
+        view = memoryview(b).cast("B")
+        stop = len(view) - _utf8_tail(view)
+        if stop < len(view):
+            self._carry = bytes(view[stop:])
+
+        offset = 0
         backoff = 0.0001
-        while True:
-            n = self.rb.write(full_msg)
+        while offset < stop:
+            end = self._chunk_end(view, offset, stop)
+            n = self.rb.write(view[offset:end], self._header)
             if n > 0:
-                try:
-                    self.sock.sendall(b"DATA\n")
-                except BrokenPipeError:
-                    break
-                return len(data)  # Pretend we wrote the text length
+                offset = end
+                backoff = 0.0001
+                self.rb.mark_pending()
+                self._notify_pending = True
+                self._unnotified_bytes += n
             else:
+                # Ring is full: make sure the supervisor drains it.
+                if self._notify_pending and not self._notify():
+                    break
                 time.sleep(backoff)
                 backoff = min(backoff * 2, 0.001)
 
+        # Coalesce notifications: at most one DATA per write, and only for
+        # large bursts since the supervisor also polls the pending flag.
+        if self._notify_pending and (
+            self._unnotified_bytes >= NOTIFY_BYTES
+            or time.monotonic() - self._last_notify > NOTIFY_INTERVAL
+        ):
+            self._notify()
+
+        return consumed
+
     def flush(self):
-        pass
+        if self._carry:
+            # Nothing will complete the sequence now; emit it as U+FFFD.
+            carry, self._carry = self._carry, b""
+            self.write(carry.decode("utf-8", "replace").encode("utf-8"))
+        if self._notify_pending:
+            self._notify()
 
 
 ORIGINAL_OPEN = builtins.open
+# open() mode characters that make a call a write.
+_WRITE_FLAGS = frozenset("wa+x")
+
+
+def _path_bytes(path):
+    # open() and listdir() also take file descriptors; report those by number.
+    if isinstance(path, int):
+        return str(path).encode("ascii")
+    return os.fsencode(path)
+
+
 GLOBAL_POLICY_CLIENT = None
 
 
@@ -246,43 +665,55 @@ def install_policy_hooks(policy_client):
     original_create_connection = socket.create_connection
 
     def guarded_open(path, mode="r", *args, **kwargs):
+        if not policy_client.needs_check(POLICY_CHECK_FS):
+            return original_open(path, mode, *args, **kwargs)
+
         # Determine if write
-        is_write = any(flag in mode for flag in ["w", "a", "+", "x"])
-        path_bytes = str(path).encode("utf-8")
+        is_write = not _WRITE_FLAGS.isdisjoint(mode)
+        path_bytes = _path_bytes(path)
 
         if is_write:
             # Sync
-            allowed = policy_client.send_sync(MSG_TYPE_FS_WRITE, path_bytes)
+            allowed = policy_client.check(MSG_TYPE_FS_WRITE, path_bytes)
             if not allowed:
                 raise PermissionError(f"policy denied write: {path}")
         else:
             # Optimistic
-            policy_client.send_optimistic(MSG_TYPE_FS_READ, path_bytes)
+            policy_client.report(MSG_TYPE_FS_READ, path_bytes)
 
         return original_open(path, mode, *args, **kwargs)
 
     def guarded_listdir(path="."):
-        path_bytes = str(path).encode("utf-8")
-        policy_client.send_optimistic(MSG_TYPE_LISTDIR, path_bytes)
+        if not policy_client.needs_check(POLICY_CHECK_FS):
+            return original_listdir(path)
+
+        path_bytes = _path_bytes(path)
+        policy_client.report(MSG_TYPE_LISTDIR, path_bytes)
         return original_listdir(path)
 
     def guarded_run(cmd, *args, **kwargs):
+        if not policy_client.needs_check(POLICY_CHECK_EXEC):
+            return original_run(cmd, *args, **kwargs)
+
         cmd_str = (
             cmd[0] if isinstance(cmd, (list, tuple)) and cmd else str(cmd).split(" ")[0]
         )
-        cmd_bytes = str(cmd_str).encode("utf-8")
+        cmd_bytes = _path_bytes(cmd_str)
 
-        allowed = policy_client.send_sync(MSG_TYPE_EXEC, cmd_bytes)
+        allowed = policy_client.check(MSG_TYPE_EXEC, cmd_bytes)
         if not allowed:
             raise PermissionError(f"policy denied exec: {cmd_str}")
 
         return original_run(cmd, *args, **kwargs)
 
     def guarded_create_connection(address, *args, **kwargs):
+        if not policy_client.needs_check(POLICY_CHECK_NET):
+            return original_create_connection(address, *args, **kwargs)
+
         host, port = address
         payload = f"{host}:{port}".encode("utf-8")
 
-        allowed = policy_client.send_sync(MSG_TYPE_NET_CONNECT, payload)
+        allowed = policy_client.check(MSG_TYPE_NET_CONNECT, payload)
         if not allowed:
             raise PermissionError(f"policy denied net: {host}:{port}")
 
@@ -294,12 +725,103 @@ def install_policy_hooks(policy_client):
     socket.create_connection = guarded_create_connection
 
 
-def send_state(sock, event, data=None):
+_CODE_CACHE = OrderedDict()
+
+
+def compile_code(key, code_str):
+    """Compile a cell once and cache it by content hash.
+
+    Returns (code_object, mode) where mode is "eval" or "exec".
+    """
+    cached = _CODE_CACHE.get(key)
+    if cached is not None:
+        _CODE_CACHE.move_to_end(key)
+        return cached
+
+    # Parse once; a cell that is a single expression is evaluated so its
+    # value can be echoed, anything else runs as a module body.
+    tree = ast.parse(code_str, "<input>", "exec")
+    if len(tree.body) == 1 and isinstance(tree.body[0], ast.Expr):
+        expr = ast.Expression(body=tree.body[0].value)
+        cached = (compile(expr, "<input>", "eval"), "eval")
+    else:
+        cached = (compile(tree, "<input>", "exec"), "exec")
+
+    if len(code_str) > CODE_CACHE_MAX_SOURCE:
+        return cached
+    _CODE_CACHE[key] = cached
+    if len(_CODE_CACHE) > CODE_CACHE_SIZE:
+        _CODE_CACHE.popitem(last=False)
+    return cached
+
+
+def parse_cell(msg):
+    """Split a bun2py message into (msg_type, key, code_str).
+
+    key and code_str are only set for CODE messages.
+    """
+    # [Type: 1][ReqID: 4][Payload: N]
+    if len(msg) < 5:
+        return None, None, None
+    msg_type = msg[0]
+    if msg_type != MSG_TYPE_CODE:
+        return msg_type, None, None
+    payload = memoryview(msg)[5:]
+    key = hashlib.blake2b(payload, digest_size=16).digest()
+    return msg_type, key, str(payload, "utf-8")
+
+
+def wait_for_wakeup(sock, timeout):
+    """Block until the supervisor rings the socket doorbell or timeout expires.
+
+    Returns False once the supervisor has closed the socket.
+    """
+    readable, _, _ = select.select([sock], [], [], timeout)
+    if readable:
+        try:
+            if not sock.recv(4096, socket.MSG_DONTWAIT):
+                return False
+        except BlockingIOError:
+            pass
+    return True
+
+
+def state_line(event, data=None):
     state = {"type": "state", "event": event}
     if data is not None:
         state["data"] = data
-    state_json = json.dumps(state)
-    sock.sendall(state_json.encode("utf-8") + b"\n")
+    if orjson is not None:
+        return orjson.dumps(state, option=orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(state, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def send_state(sock, *events, notice=b""):
+    """Send one or more (event, data) state events in a single write.
+
+    notice is sent ahead of the events in the same write.
+    """
+    sock.sendall(notice + b"".join(state_line(*event) for event in events))
+
+
+def _open_shm(name):
+    if sys.version_info >= (3, 13):
+        # Bun supervisor owns shared memory lifecycle, not Python
+        return shared_memory.SharedMemory(name=name, create=False, track=False)
+    shm = shared_memory.SharedMemory(name=name, create=False)
+    unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
+    return shm
+
+
+def attach_shm(shm_name):
+    """Attach to the supervisor's segment, or return None if it is missing.
+
+    SharedMemory adds the leading slash itself, so the bare name maps to
+    the same shm_open() name the supervisor created on every platform.
+    """
+    try:
+        return _open_shm(shm_name.lstrip("/"))
+    except FileNotFoundError:
+        return None
 
 
 def main():
@@ -311,110 +833,150 @@ def main():
     shm_name = sys.argv[2]
     shm_size = int(sys.argv[3])
 
-    shm = None
-    names_to_try = [
-        shm_name,
-        "/" + shm_name if not shm_name.startswith("/") else shm_name,
-        shm_name.lstrip("/"),
-    ]
-
-    for name in set(names_to_try):
-        try:
-            shm = shared_memory.SharedMemory(name=name)
-            # Bun supervisor owns shared memory lifecycle, not Python
-            unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
-            break
-        except FileNotFoundError:
-            pass
+    shm = attach_shm(shm_name)
 
     if shm is None:
         print(f"[Python] SHM not found")
         return
 
-    ring_size = shm_size // 2
+    # [bun2py][py2bun: stdout][py2bun_ctrl: policy checks], equal sizes.
+    ring_size = shm_size // 3
     bun2py = SharedRingBuffer(shm.buf, 0, ring_size)
     py2bun = SharedRingBuffer(shm.buf, ring_size, ring_size)
+    py2bun_ctrl = SharedRingBuffer(shm.buf, 2 * ring_size, ring_size)
 
     sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
 
+    # The supervisor is usually listening already; back off from 1ms so a
+    # quick start isn't held up, but keep waiting up to 3s for a slow one.
     connected = False
-    for i in range(30):
+    delay = 0.001
+    deadline = time.monotonic() + 3.0
+    while True:
         try:
             sock.connect(socket_path)
             connected = True
             break
-        except Exception:
-            time.sleep(0.1)
+        except (FileNotFoundError, ConnectionRefusedError):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.1)
 
     if not connected:
         return
 
     sock.sendall(b"READY\n")
 
-    policy_client = PolicyClient(bun2py, py2bun, sock)
+    policy_client = PolicyClient(bun2py, py2bun_ctrl, sock)
     install_policy_hooks(policy_client)
 
     global_context = {}
     global_context["__name__"] = "__main__"
     global_context["__builtins__"] = builtins
 
-    output_capture = ShmOut(py2bun, sock)
+    raw_output = ShmOut(py2bun, sock)
+    output_capture = io.TextIOWrapper(
+        io.BufferedWriter(raw_output, STDOUT_BUFFER),
+        encoding="utf-8",
+        write_through=False,
+        # Output streams line by line; ShmOut coalesces the DATA
+        # notifications, so a line costs a ring write, not a syscall.
+        line_buffering=True,
+    )
+
+    def flush_output():
+        # BufferedWriter.flush() does not reach the raw stream's flush(),
+        # which is what sends the coalesced DATA notification.
+        output_capture.flush()
+        raw_output.flush()
+
+    def cell_notice():
+        # Optimistic reports only set the pending flag; signal them with the
+        # cell's end event so a violation is judged before the cell ends.
+        # Flush first so the DATA owed for the cell's last output is included.
+        output_capture.flush()
+        return policy_client.take_notice() + raw_output.take_notice()
+
+    original_stdout = sys.stdout
 
     try:
-        idle_backoff = 0.0001
+        idle_spins = 0
+        inbox = policy_client.inbox
         while True:
-            msg = bun2py.read()
-            if msg is None:
-                time.sleep(idle_backoff)
-                idle_backoff = min(idle_backoff * 2, 0.001)
-                continue
-            idle_backoff = 0.0001
-
-            # [Type: 1][ReqID: 4][Payload: N]
-            if len(msg) < 5:
-                continue
-
-            msg_type = msg[0]
-            # Skip ReqID (bytes 1-5)
-            payload = msg[5:]
-
+            if not inbox:
+                if bun2py.empty():
+                    idle_spins += 1
+                    if idle_spins < IDLE_SPIN_LIMIT:
+                        continue
+                    if idle_spins < IDLE_YIELD_LIMIT:
+                        time.sleep(0)
+                    elif not policy_client.wait_idle(IDLE_WAIT):
+                        break
+                    continue
+                # Take everything queued at once: one head update, and the
+                # ring has room for policy responses while the cells run.
+                policy_client.read_cells(READ_BATCH)
+                if not inbox:
+                    continue
+            idle_spins = 0
+
+            msg_type, key, code_str = parse_cell(inbox.popleft())
             if msg_type != MSG_TYPE_CODE:
                 # Ignore other messages in main loop
                 continue
 
-            code_str = payload.decode("utf-8")
-            send_state(sock, "code_received", {"code_length": len(code_str)})
-
-            original_stdout = sys.stdout
+            # Re-installed per cell in case an earlier one replaced it.
             sys.stdout = output_capture
 
             try:
-                send_state(sock, "exec_start")
+                send_state(
+                    sock,
+                    ("code_received", {"code_length": len(code_str)}),
+                    ("exec_start",),
+                )
                 try:
-                    result = None
-                    try:
-                        result = eval(code_str, global_context)
-                        if result is not None:
-                            print(result)
-                    except SyntaxError:
-                        exec(code_str, global_context)
-                    send_state(sock, "exec_end", {"success": True, "exitCode": 0})
+                    code_obj, mode = compile_code(key, code_str)
+                    # eval() runs exec-mode code objects too (returning None).
+                    result = eval(code_obj, global_context)
+                    if mode == "eval" and result is not None:
+                        print(result)
+                    # The last DATA of the cell rides along with exec_end.
+                    send_state(
+                        sock,
+                        ("exec_end", {"success": True, "exitCode": 0}),
+                        notice=cell_notice(),
+                    )
                 except KeyboardInterrupt:
-                    send_state(sock, "interrupted")
+                    send_state(sock, ("interrupted",), notice=cell_notice())
             except Exception as e:
                 exc_type, exc_value, exc_traceback = sys.exc_info()
                 type_name = exc_type.__name__ if exc_type else "Exception"
                 error_msg = f"{type_name}: {exc_value}"
-                send_state(sock, "exception", {"error": error_msg, "exitCode": 1})
-                lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
-                print("".join(lines))
+                send_state(
+                    sock,
+                    ("exception", {"error": error_msg, "exitCode": 1}),
+                    notice=cell_notice(),
+                )
+                # Keep only the innermost frames; denied operations raise
+                # routinely and deep stacks are expensive to render.
+                te = traceback.TracebackException(
+                    exc_type, exc_value, exc_traceback, limit=-WORKER_TB_LIMIT
+                )
+                print("".join(te.format()))
             finally:
-                sys.stdout = original_stdout
+                flush_output()
 
     except KeyboardInterrupt:
         pass
     finally:
+        flush_output()
+        sys.stdout = original_stdout
         sock.close()
+        bun2py.close()
+        py2bun.close()
+        py2bun_ctrl.close()
         shm.close()
 
 